@@ -0,0 +1,182 @@
+"""This module provides the mirroring of static assets (images, PDFs, downloads,
+etc.) from the Markdown directory to the output directory. The files to mirror
+are chosen by their extensions, given by the "assets" option in presto.ini.
+Like drafts, an asset is only copied again when its hash changes (see
+publish.publish_file()).
+
+An asset is copied without reading it into memory, using the fastest method
+the platform supports: a hard link to the original file, if the "link_assets"
+option is set, a copy-on-write clone (a reflink, on file systems that support
+them), os.copy_file_range() or os.sendfile(), and otherwise an ordinary copy
+in chunks.
+"""
+from __future__ import with_statement
+
+import os
+import io
+import sys
+import errno
+import shutil
+
+import presto.config as config
+
+
+_CHUNK_SIZE = 1024 * 1024
+
+# from linux/fs.h; makes a file share the extents of another
+_FICLONE = 0x40049409
+
+# errors meaning that a copy method does not work for these files, so the
+# next one should be tried
+_UNSUPPORTED = set(getattr(errno, name) for name in [
+    'EXDEV', 'EINVAL', 'ENOSYS', 'ENOTSUP', 'EOPNOTSUPP', 'EBADF', 'ENOTTY',
+    'EPERM'
+] if hasattr(errno, name))
+
+
+def get_extensions():
+    """Return the set of extensions (in lowercase, without the dot) of the
+    files to mirror, or an empty set if no files should be mirrored. The
+    extension "*" means every file.
+    """
+    value = config.get('assets') or ''
+    return set(s.strip().lower().lstrip('.') for s in value.split(',') if s.strip())
+
+
+def is_asset(filename, extensions):
+    if '*' in extensions:
+        return True
+
+    _, ext = os.path.splitext(filename)
+    return ext.lower().lstrip('.') in extensions
+
+
+def _link_assets():
+    return (config.get('link_assets') or '').strip().lower() in ['1', 'yes', 'true', 'on']
+
+
+def _clone(src, dst):
+    import fcntl
+    fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+
+
+def _copy_file_range(src, dst):
+    size = os.fstat(src.fileno()).st_size
+    offset = 0
+
+    while offset < size:
+        n = os.copy_file_range(src.fileno(), dst.fileno(), size - offset)
+        if n == 0:
+            break
+
+        offset += n
+
+
+def _sendfile(src, dst):
+    size = os.fstat(src.fileno()).st_size
+    offset = 0
+
+    while offset < size:
+        n = os.sendfile(dst.fileno(), src.fileno(), offset, size - offset)
+        if n == 0:
+            break
+
+        offset += n
+
+
+def _chunked_copy(src, dst):
+    shutil.copyfileobj(src, dst, _CHUNK_SIZE)
+
+
+def _copy_methods():
+    methods = []
+
+    if sys.platform.startswith('linux'):
+        methods.append(('reflink', _clone))
+
+    if hasattr(os, 'copy_file_range'):
+        methods.append(('copy_file_range', _copy_file_range))
+
+    if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+        # other platforms can only send files to sockets
+        methods.append(('sendfile', _sendfile))
+
+    methods.append(('copy', _chunked_copy))
+    return methods
+
+
+def copy(src_path, dst_path):
+    """Copy the file at src_path to dst_path, which must not exist, and return
+    the name of the method that was used.
+    """
+    methods = _copy_methods()
+
+    with io.open(src_path, mode='rb') as src:
+        with io.open(dst_path, mode='wb') as dst:
+            for name, method in methods:
+                try:
+                    method(src, dst)
+                    return name
+                except (IOError, OSError) as e:
+                    if name == 'copy' or e.errno not in _UNSUPPORTED:
+                        raise
+
+                # start again from the beginning of both files
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+
+
+def mirror(src_path, dst_path):
+    """Replace the file at dst_path with a copy of (or, if the link_assets
+    option is set, a hard link to) the file at src_path, and return the name
+    of the method that was used. The copy is made under a temporary name in
+    the same directory, so that the file is never seen half-written.
+    """
+    head, tail = os.path.split(dst_path)
+
+    # the leading '.' makes the cleanup of the output directory ignore this
+    # file, if it is ever left behind
+    tmp_path = os.path.join(head, '.{}.{}.tmp'.format(tail, os.getpid()))
+
+    if _link_assets():
+        try:
+            if os.path.samefile(src_path, dst_path):
+                # already a hard link to the file (which was changed in
+                # place), and replacing a file with a link to itself would do
+                # nothing, leaving the temporary link behind
+                return 'link'
+        except OSError:
+            # the output file does not exist yet
+            pass
+
+    try:
+        method = None
+
+        if _link_assets():
+            try:
+                os.link(src_path, tmp_path)
+                method = 'link'
+            except OSError:
+                # e.g., the directories are on different file systems
+                pass
+
+        if method is None:
+            method = copy(src_path, tmp_path)
+
+        if hasattr(os, 'replace'):
+            os.replace(tmp_path, dst_path)
+        else:
+            # os.rename() replaces the file atomically on POSIX systems
+            os.rename(tmp_path, dst_path)
+
+        # if the files were hard links to the same file after all (such as
+        # when another run linked them in the meantime), the rename did nothing
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return method
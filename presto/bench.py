@@ -0,0 +1,414 @@
+"""This module provides a benchmark for Presto. It generates a synthetic site,
+which is the same for the same number of pages and random seed, and publishes
+it several times, each time in a new process running "python -m presto":
+
+    cold        with no output directory or cache files
+    no-op       again, when nothing has changed
+    touch-one   after changing one draft
+
+For each build it reports the time taken, the pages converted per second (of
+the pages the build converted, so not for a build that converted none), the
+peak resident set size of the process, and the time spent in each stage of
+publishing (as reported by the --profile option; see presto.profiler).
+
+Run it from the root of the repository:
+
+    python -m presto.bench --pages 500 --seed 1
+
+The drafts use the Markdown features Presto enables: metadata headers, grid
+tables, code blocks in several languages (highlighted by Pygments), footnotes,
+[TOC] markers, MathJax spans and {-sequences, including calls to partial().
+Since the fenced_code extension is not enabled, code blocks are indented, and
+their language is given with a ":::language" line.
+
+This module does not import presto.options, so it has options of its own.
+"""
+from __future__ import print_function, with_statement
+
+import sys
+import os
+import io
+import json
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import argparse
+
+import six
+
+
+_SCENARIOS = ['cold', 'no-op', 'touch-one']
+_STAGES = ['hash', 'metadata', 'body', 'markdown', 'treeprocessor:hilite',
+           'treeprocessor:inline', 'template', 'write']
+
+_PAGES_PER_DIR = 50
+
+_INI = u"""[presto]
+markdown_dir = drafts
+partials_dir = partials
+output_dir = output
+template_file = template.html
+cache_file = cache
+whitelist =
+
+[variables]
+site_name = Benchmark site
+footer = Generated by presto.bench
+"""
+
+_TEMPLATE = u"""<!doctype html>
+<html>
+<head>
+<title>{= title =} | {= site_name =}</title>
+<meta charset="UTF-8">
+</head>
+<body>
+{= partial('nav.html') =}
+<h1>{= title =}</h1>
+{= content =}
+<footer>{= footer =}</footer>
+</body>
+</html>
+"""
+
+_NAV = u"""<nav>
+<a href="/">Home</a> <a href="/section0/">Section 0</a> <a href="/about">About</a>
+</nav>
+"""
+
+_NOTE = u"""*This note is included from a partial.*"""
+
+_CODE = {
+    'python': u"""def fib(n):
+    a, b = 0, 1
+    for _ in range(n):
+        a, b = b, a + b
+    return a
+
+print([fib(i) for i in range(10)])""",
+
+    'c': u"""#include <stdio.h>
+
+int main(int argc, char **argv) {
+    for (int i = 0; i < argc; i++) {
+        printf("%d: %s\\n", i, argv[i]);
+    }
+    return 0;
+}""",
+
+    'javascript': u"""function debounce(fn, ms) {
+    let timer = null;
+    return function (...args) {
+        clearTimeout(timer);
+        timer = setTimeout(() => fn.apply(this, args), ms);
+    };
+}""",
+
+    'bash': u"""for f in *.markdown; do
+    echo "processing $f"
+    wc -l "$f" | awk '{ print $1 }'
+done""",
+
+    'java': u"""public class Point {
+    private final int x, y;
+
+    public Point(int x, int y) {
+        this.x = x;
+        this.y = y;
+    }
+
+    public double distance(Point o) {
+        return Math.hypot(x - o.x, y - o.y);
+    }
+}""",
+}
+
+_WORDS = (u'lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+          u'eiusmod tempor incididunt ut labore et dolore magna aliqua ut enim '
+          u'ad minim veniam quis nostrud exercitation ullamco laboris nisi '
+          u'aliquip ex ea commodo consequat').split()
+
+
+def _sentence(rng):
+    words = [rng.choice(_WORDS) for i in range(rng.randint(6, 16))]
+    return u' '.join(words).capitalize() + u'.'
+
+
+def _paragraph(rng):
+    return u' '.join(_sentence(rng) for i in range(rng.randint(2, 5)))
+
+
+def _code_block(rng):
+    language = rng.choice(sorted(_CODE))
+    lines = [u':::' + language] + _CODE[language].split(u'\n')
+    return u'\n'.join(u'    ' + line for line in lines)
+
+
+def _grid_table(rng):
+    rows = rng.randint(2, 5)
+    border = u'+------------+------------+------------+'
+    lines = [border, u'| Name       | Value      | Notes      |',
+             border.replace(u'-', u'=')]
+
+    for i in range(rows):
+        cells = [rng.choice(_WORDS), six.text_type(rng.randint(0, 9999)),
+                 rng.choice(_WORDS)]
+        lines.append(u'| ' + u' | '.join(c.ljust(10) for c in cells) + u' |')
+        lines.append(border)
+
+    return u'\n'.join(lines)
+
+
+def make_draft(rng, n):
+    """Return the contents of the nth draft of a synthetic site."""
+    parts = [
+        u'title: Page {}'.format(n),
+        u'author: Author {}'.format(rng.randint(1, 20)),
+        u'tags: {}'.format(rng.choice(_WORDS)),
+        u'      {}'.format(rng.choice(_WORDS)),
+        u'',
+        u'[TOC]',
+        u'',
+        u'Welcome to page {= title =}, which has ' +
+        u'{~ len(metadata) ~} metadata variables.',
+    ]
+
+    num_footnotes = 0
+
+    for section in range(rng.randint(2, 5)):
+        parts += [u'', u'## Section {}'.format(section), u'']
+
+        for i in range(rng.randint(1, 3)):
+            paragraph = _paragraph(rng)
+
+            if rng.random() < 0.5:
+                num_footnotes += 1
+                paragraph += u'[^{}]'.format(num_footnotes)
+
+            if rng.random() < 0.4:
+                paragraph += u' Inline math is $x_{0}^{2} + \\alpha$.'
+
+            parts += [paragraph, u'']
+
+        kind = rng.randint(0, 4)
+        if kind == 0:
+            parts += [_code_block(rng), u'']
+        elif kind == 1:
+            parts += [_grid_table(rng), u'']
+        elif kind == 2:
+            parts += [u'$$\\sum_{i=0}^{n} i = \\frac{n(n+1)}{2}$$', u'']
+        elif kind == 3:
+            parts += [
+                u'{!',
+                u'for i in range({}):'.format(rng.randint(2, 6)),
+                u"    print('*   generated item {}'.format(i))",
+                u'!}',
+                u'',
+            ]
+        else:
+            parts += [u"{= partial('note.md') =}", u'']
+
+    parts += [_code_block(rng), u'']
+
+    for i in range(1, num_footnotes + 1):
+        parts.append(u'[^{}]: {}'.format(i, _sentence(rng)))
+
+    return u'\n'.join(parts) + u'\n'
+
+
+def draft_relpath(n):
+    return os.path.join('section{}'.format(n // _PAGES_PER_DIR), 'page{}.markdown'.format(n))
+
+
+def generate_site(site_dir, num_pages, seed):
+    """Write a synthetic site with the specified number of drafts to the
+    specified directory. The same number of pages and seed always produce the
+    same site.
+    """
+    rng = random.Random(seed)
+
+    for d in ['drafts', 'partials']:
+        os.makedirs(os.path.join(site_dir, d))
+
+    files = {
+        'presto.ini': _INI,
+        'template.html': _TEMPLATE,
+        os.path.join('partials', 'nav.html'): _NAV,
+        os.path.join('partials', 'note.md'): _NOTE,
+    }
+
+    for n in range(num_pages):
+        files[os.path.join('drafts', draft_relpath(n))] = make_draft(rng, n)
+
+    for relpath, content in sorted(files.items()):
+        path = os.path.join(site_dir, relpath)
+
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        with io.open(path, mode='w', encoding='utf-8') as f:
+            f.write(content)
+
+
+def run_build(site_dir, report_path, extra_args):
+    """Run "python -m presto" on the site, and return a (wall time, peak RSS in
+    megabytes, profile report) tuple. The peak RSS is None if it cannot be
+    measured on this platform.
+    """
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [repo_dir] + [p for p in [env.get('PYTHONPATH')] if p]
+    )
+
+    args = [sys.executable, '-m', 'presto', '-c', 'presto.ini', '--hide-skipped',
+            '--profile=' + report_path] + extra_args
+
+    with io.open(os.devnull, mode='wb') as devnull:
+        start = time.time()
+        proc = subprocess.Popen(args, cwd=site_dir, env=env, stdout=devnull,
+                                stderr=subprocess.PIPE)
+        err = proc.stderr.read()
+
+        if hasattr(os, 'wait4'):
+            # the rusage of this child alone (RUSAGE_CHILDREN would include
+            # every earlier build)
+            pid, status, rusage = os.wait4(proc.pid, 0)
+
+            if os.WIFSIGNALED(status):
+                proc.returncode = -os.WTERMSIG(status)
+            else:
+                proc.returncode = os.WEXITSTATUS(status)
+
+            maxrss = rusage.ru_maxrss / 1024.0
+
+            if sys.platform == 'darwin':
+                # bytes on macOS, kilobytes elsewhere
+                maxrss /= 1024.0
+        else:
+            proc.wait()
+            maxrss = None
+
+        wall = time.time() - start
+
+    if proc.returncode != 0:
+        sys.stderr.write(err.decode('utf-8', 'replace'))
+        raise RuntimeError('presto exited with status {}'.format(proc.returncode))
+
+    with io.open(report_path, encoding='utf-8') as f:
+        report = json.load(f)
+
+    return wall, maxrss, report
+
+
+def run_scenarios(site_dir, num_pages, extra_args):
+    results = []
+
+    for scenario in _SCENARIOS:
+        if scenario == 'touch-one':
+            path = os.path.join(site_dir, 'drafts', draft_relpath(num_pages // 2))
+            with io.open(path, mode='a', encoding='utf-8') as f:
+                f.write(u'\nThis paragraph was added by the touch-one build.\n')
+
+        report_path = os.path.join(site_dir, 'profile-{}.json'.format(scenario))
+        wall, maxrss, report = run_build(site_dir, report_path, extra_args)
+
+        converted = sum(1 for page in report['pages'] if 'markdown' in page['stages'])
+
+        results.append({
+            'scenario': scenario,
+            'pages': num_pages,
+            'converted': converted,
+            'wall': wall,
+            'pages_per_second': converted / wall if converted else None,
+            'peak_rss_mb': maxrss,
+            'stages': {stage: report['totals'].get(stage, {'wall': 0.0})['wall']
+                       for stage in _STAGES},
+        })
+
+    return results
+
+
+def print_results(results):
+    print('{:<10} {:>9} {:>9} {:>9} {:>10} {:>9}'.format(
+        'build', 'pages', 'converted', 'wall (s)', 'pages/s', 'RSS (MB)'
+    ))
+    for r in results:
+        rss = '-' if r['peak_rss_mb'] is None else '{:.1f}'.format(r['peak_rss_mb'])
+        rate = ('-' if r['pages_per_second'] is None
+                else '{:.1f}'.format(r['pages_per_second']))
+        print('{:<10} {:>9} {:>9} {:>9.3f} {:>10} {:>9}'.format(
+            r['scenario'], r['pages'], r['converted'], r['wall'], rate, rss
+        ))
+
+    print()
+    print('{:<22}'.format('stage (wall s)') +
+          ''.join('{:>10}'.format(r['scenario']) for r in results))
+    for stage in _STAGES:
+        print('{:<22}'.format(stage) +
+              ''.join('{:>10.3f}'.format(r['stages'][stage]) for r in results))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m presto.bench',
+        description='Benchmark Presto by publishing a synthetic site'
+    )
+    parser.add_argument(
+        '-n', '--pages',
+        type=int,
+        default=200,
+        help='number of drafts in the synthetic site (default is 200)'
+    )
+    parser.add_argument(
+        '-s', '--seed',
+        type=int,
+        default=0,
+        help='seed for generating the synthetic site (default is 0)'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        metavar='N',
+        help='pass --jobs N to presto (default is 1)'
+    )
+    parser.add_argument(
+        '-d', '--dir',
+        help='generate the site in this directory, which must not exist, and '
+             'keep it afterward (default is a temporary directory)'
+    )
+    parser.add_argument(
+        '--json',
+        metavar='PATH',
+        help='also write the results as JSON to PATH'
+    )
+    args = parser.parse_args(argv)
+
+    if args.dir:
+        site_dir = os.path.abspath(args.dir)
+    else:
+        site_dir = os.path.join(tempfile.mkdtemp(prefix='presto-bench-'), 'site')
+
+    generate_site(site_dir, args.pages, args.seed)
+    print('generated {} pages in {} (seed {})'.format(args.pages, site_dir, args.seed))
+    print()
+
+    try:
+        results = run_scenarios(site_dir, args.pages, ['--jobs', str(args.jobs)])
+    finally:
+        if not args.dir:
+            shutil.rmtree(os.path.dirname(site_dir))
+
+    print_results(results)
+
+    if args.json:
+        with io.open(args.json, mode='w') as f:
+            f.write(six.text_type(json.dumps(results, indent=2, sort_keys=True)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,512 @@
+"""This module provides the steps of a complete run of Presto: finding the files
+in the Markdown directory, publishing the ones that changed (see
+presto.publish), removing output files whose sources no longer exist, and
+saving the cache files.
+"""
+from __future__ import print_function, with_statement
+
+import os
+import io
+import heapq
+
+import six
+
+import presto.output as output
+import presto.config as config
+import presto.convert as convert
+import presto.options as options
+import presto.publish as publish
+import presto.bytecode as bytecode
+import presto.deps as deps
+import presto.builddb as builddb
+import presto.pageindex as pageindex
+import presto.assets as assets
+import presto.compress as compress
+import presto.profiler as profiler
+import presto.watchdog as watchdog
+from presto.publish import (config_get, config_get_filepath, should_publish,
+                            is_markdown, extension_to_html, extension_drop)
+
+
+_BATCH_SIZE = 256                   # changed files saved per transaction
+_SLOWEST_SEQUENCES = 5              # slowest {-sequences kept in the summary
+
+
+class Summary(object):
+    """Counts of what happened during a run, printed at the end of it."""
+
+    def __init__(self):
+        self.published = 0
+        self.identical = 0
+        self.skipped = 0
+        self.removed = 0
+        self.errors = 0
+        self.code_hits = 0
+        self.code_misses = 0
+
+        # (seconds, relpath, location) of the slowest {-sequences
+        self.slowest = []
+
+    def add_sequence_times(self, relpath, times):
+        """Given the relative path of a page and the (seconds, location)
+        tuples of its slowest {-sequences, keep the slowest of the run.
+        """
+        if times:
+            self.slowest = heapq.nlargest(
+                _SLOWEST_SEQUENCES,
+                self.slowest + [(seconds, relpath, location) for seconds, location in times]
+            )
+
+    def __str__(self):
+        return ('{} files published, {} files identical, {} files skipped, '
+                '{} files removed; {} errors; {} bytecode cache hits, {} misses'.format(
+            self.published, self.identical, self.skipped, self.removed,
+            self.errors, self.code_hits, self.code_misses
+        ))
+
+
+def load_template():
+    with io.open(config_get_filepath('template_file')) as f:
+        return convert.Template(f.read())
+
+
+def load_caches(summary):
+    """Load the bytecode cache file and return the contents of the build
+    database (a builddb.Cache object), counting an error in the summary if
+    either cannot be read.
+    """
+    try:
+        bytecode.load(publish.get_bytecode_cache_path())
+    except:
+        if options.get('debug'):
+            output.traceback()
+
+        output.error('could not open bytecode cache file')
+        summary.errors += 1
+
+    try:
+        cache = builddb.load(config_get_filepath('cache_file'), options.get('dry_run'))
+        pageindex.load(builddb.load_index())
+        return cache
+    except:
+        if options.get('debug'):
+            output.traceback()
+
+        output.error('could not open cache file')
+        summary.errors += 1
+        return builddb.Cache()
+
+
+def find_files(cache):
+    """Walk the Markdown directory and return a (tasks, expected_files) tuple,
+    where tasks is a list of arguments for publish.publish_file(), sorted by
+    relative path, and expected_files is a set of the relative paths (without
+    extensions) of the output files that should exist. Besides drafts, the
+    tasks include htaccess files and the static assets to mirror (see
+    presto.assets). The metadata index is brought up to date along the way.
+    """
+    expected_files = set()
+    tasks = []
+    asset_extensions = assets.get_extensions()
+
+    for dirpath, dirnames, filenames in os.walk(config_get_filepath('markdown_dir')):
+        for f in filenames:
+            if (not is_markdown(f) and f != 'htaccess' and
+                    not assets.is_asset(f, asset_extensions)):
+                continue
+
+            if f[0] in ['.', '#']:
+                continue
+
+            if f[-1] == '~':
+                continue
+
+            path = os.path.join(dirpath, f)
+            relpath = os.path.relpath(path, config_get_filepath('markdown_dir'))
+
+            if should_publish(path):
+                expected_files.add(extension_drop(relpath))
+            else:
+                cache.pop(relpath, None)
+
+            if is_markdown(f):
+                pageindex.update(path, relpath)
+
+            tasks.append((path, relpath, cache.get(relpath)))
+
+    # forget the files that no longer exist
+    found = set(task[1] for task in tasks)
+    for relpath in [relpath for relpath in cache if relpath not in found]:
+        cache.pop(relpath)
+
+    pageindex.prune(found)
+
+    # publish in a deterministic order, whether or not worker processes are used
+    tasks.sort(key=lambda task: task[1])
+
+    return tasks, expected_files
+
+
+def remove_sidecar(path, summary):
+    try:
+        compress.remove_sidecar(path)
+    except:
+        if options.get('debug'):
+            output.traceback()
+
+        output.error("could not remove gzip sidecar '{}'".format(compress.sidecar_path(path)))
+        summary.errors += 1
+
+
+def publish_files(tasks, template, cache, summary):
+    jobs = options.get('jobs')
+    threads = options.get('threads')
+
+    if watchdog.has_limits():
+        # a page that runs out of time may not stop by itself, and only a
+        # process can be made to stop (see presto.watchdog), so pages are
+        # published by worker processes even if threads were asked for
+        pool = watchdog.Pool(
+            max(jobs, threads),
+            initializer=publish.init_worker,
+            initargs=(config.get_ini_path(), template, pageindex.get_entries())
+        )
+        results = pool.imap(publish.publish_file, tasks, publish.stopped_result)
+    elif jobs > 1:
+        import multiprocessing
+
+        pool = multiprocessing.Pool(
+            jobs,
+            initializer=publish.init_worker,
+            initargs=(config.get_ini_path(), template, pageindex.get_entries())
+        )
+        results = pool.imap(publish.publish_file, tasks, chunksize=4)
+    elif threads > 1:
+        from multiprocessing.pool import ThreadPool
+
+        # the threads share this process's template, caches and config
+        publish.set_template(template)
+        pool = ThreadPool(threads)
+        results = pool.imap(publish.publish_file, tasks, chunksize=4)
+    else:
+        pool = None
+        publish.set_template(template)
+        results = six.moves.map(publish.publish_file, tasks)
+
+    # whether saving a batch of changes to the build database has failed
+    save_failed = False
+
+    output_dir = config_get_filepath('output_dir')
+
+    compressor = None
+
+    if compress.is_enabled() and not options.get('dry_run'):
+        try:
+            compressor = compress.Compressor()
+        except ValueError as e:
+            output.error(str(e))
+            summary.errors += 1
+
+    # whether every result has been handled (see compress.Compressor.finish())
+    finished = False
+
+    try:
+        for result in results:
+            output.result(result)
+            summary.errors += result.num_errors
+            summary.code_hits += result.code_hits
+            summary.code_misses += result.code_misses
+            summary.add_sequence_times(result.relpath, result.sequence_times)
+            bytecode.add(*result.new_code)
+
+            if result.timings is not None:
+                profiler.add_page(result.relpath, result.timings)
+
+            if result.status == 'published':
+                cache[result.relpath] = result.cache_entry()
+                summary.published += 1
+            elif result.status == 'identical':
+                # the output file was already up to date
+                cache[result.relpath] = result.cache_entry()
+                summary.identical += 1
+            elif result.status == 'unchanged':
+                # the file's stat key may have changed even if its hash did not
+                cache[result.relpath] = result.cache_entry()
+            elif result.status == 'skipped':
+                cache.pop(result.relpath, None)
+                summary.skipped += 1
+            elif result.status == 'failed':
+                cache.pop(result.relpath, None)
+
+            if (compressor is not None and is_markdown(result.relpath) and
+                    result.status in ['published', 'identical', 'unchanged']):
+                compressor.add(os.path.join(output_dir, extension_to_html(result.relpath)))
+            elif (compressor is None and is_markdown(result.relpath) and
+                    result.status == 'published' and not options.get('dry_run')):
+                # a sidecar written by an earlier run would now be out of date
+                remove_sidecar(os.path.join(output_dir, extension_to_html(result.relpath)),
+                               summary)
+
+            # save what has been done so far, in case the run is interrupted
+            if len(cache.changed) >= _BATCH_SIZE and not save_failed:
+                save_failed = not save_cache(cache, summary)
+
+        finished = True
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        if compressor is not None:
+            compressor.finish(summary, finished)
+
+
+def get_whitelist():
+    # post-process the whitelist: split on commas and remove extra spaces
+    return set(os.path.normpath(s.strip())
+               for s in config_get('whitelist').split(',') if s.strip())
+
+
+def get_orphan(reldirpath, f, expected_files):
+    """Given the path of a directory relative to the output directory, the
+    name of a file in it and the set of expected files (see find_files()),
+    return None if the file should be kept, or the relative path under which
+    it should be reported as removed if it is an orphan.
+    """
+    if f[0] == '.' and f != '.htaccess':
+        return None
+
+    if f == '.htaccess':
+        relpath = os.path.join(reldirpath, 'htaccess')
+    else:
+        relpath = os.path.join(reldirpath, extension_drop(f))
+
+    if relpath in expected_files:
+        return None
+
+    # a gzip sidecar (see presto.compress) is kept with its HTML file
+    if f.endswith('.gz'):
+        html_relpath = os.path.join(reldirpath, extension_drop(f[:-len('.gz')]))
+
+        if html_relpath in expected_files:
+            return None
+
+        relpath = os.path.join(reldirpath, f)
+
+    return relpath
+
+
+def walk_output_dir():
+    """Walk the output directory from the top down, like os.walk(), and
+    generate a (dirpath, reldirpath, dirnames, filenames, num_whitelisted)
+    tuple for each directory, where reldirpath is the path of the directory
+    relative to the output directory. Directories in the whitelist, and
+    everything in them, are skipped without being listed; num_whitelisted is
+    the number of them left out of dirnames.
+    """
+    output_dir = config_get_filepath('output_dir')
+    prefix = os.path.join(output_dir, '')
+    whitelist = get_whitelist()
+
+    for dirpath, dirnames, filenames in os.walk(output_dir):
+        reldirpath = '' if dirpath == output_dir else dirpath[len(prefix):]
+
+        # skip any directories specified in the whitelist (changing dirnames
+        # in place keeps os.walk() from descending into them)
+        num_dirnames = len(dirnames)
+        dirnames[:] = [d for d in dirnames
+                       if os.path.join(reldirpath, d) not in whitelist]
+
+        yield dirpath, reldirpath, dirnames, filenames, num_dirnames - len(dirnames)
+
+
+def find_orphans(expected_files):
+    """Return a sorted list of the relative paths of the files that
+    remove_orphans() would remove, not counting directories.
+    """
+    orphans = []
+
+    for dirpath, reldirpath, dirnames, filenames, _ in walk_output_dir():
+        for f in filenames:
+            relpath = get_orphan(reldirpath, f, expected_files)
+            if relpath is not None:
+                orphans.append(relpath)
+
+    return sorted(orphans)
+
+
+def remove_orphans(expected_files, cache, summary):
+    """Remove the HTML files for non-existent Markdown, and then any
+    directories in the output directory that are left empty. The output
+    directory is walked once, from the top down so that whitelisted
+    directories are skipped; the directories are then visited again in the
+    opposite order, so that a directory is visited after everything in it
+    has been removed. The output directory itself is never removed.
+    """
+    # (dirpath, number of entries left, subdirectories) of each directory
+    # walked, which may be removed once its subdirectories have been
+    walked = []
+
+    for dirpath, reldirpath, dirnames, filenames, num_whitelisted in walk_output_dir():
+        # whitelisted directories are never removed
+        num_left = num_whitelisted
+
+        for f in filenames:
+            relpath = get_orphan(reldirpath, f, expected_files)
+
+            if relpath is None:
+                num_left += 1
+                continue
+
+            cache.pop(relpath, None)
+
+            try:
+                if not options.get('dry_run'):
+                    os.remove(os.path.join(dirpath, f))
+
+                summary.removed += 1
+                output.removed(relpath)
+            except:
+                if options.get('debug'):
+                    output.traceback()
+
+                output.error("unable to remove '{}'".format(relpath))
+                summary.errors += 1
+                num_left += 1
+
+        walked.append((dirpath, num_left, list(dirnames)))
+
+    # directories removed so far (or that would have been, in a dry run)
+    removed_dirs = set()
+
+    for dirpath, num_left, dirnames in reversed(walked):
+        for d in dirnames:
+            if os.path.join(dirpath, d) not in removed_dirs:
+                num_left += 1
+
+        # remove this directory if it is now empty, unless it is the output
+        # directory itself (the first one walked), which others (such as the
+        # "serve" command) may be using
+        if num_left == 0 and dirpath != walked[0][0]:
+            try:
+                if not options.get('dry_run'):
+                    os.rmdir(dirpath)
+
+                removed_dirs.add(dirpath)
+                output.removed_directory(dirpath)
+            except:
+                if options.get('debug'):
+                    output.traceback()
+
+                output.error("unable to remove directory '{}'".format(dirpath))
+
+
+def save_cache(cache, summary, index=False):
+    """Save the changed entries of the build database, and if index is True,
+    those of the metadata index, counting an error in the summary if they
+    cannot be saved. Return True if they were saved.
+    """
+    try:
+        if not options.get('dry_run'):
+            builddb.save(cache)
+
+            if index:
+                builddb.save_index(pageindex.get_entries(), pageindex.take_changed())
+    except:
+        if options.get('debug'):
+            output.traceback()
+
+        output.error('could not write cache file')
+        summary.errors += 1
+        return False
+
+    return True
+
+
+def save_caches(cache, summary):
+    save_cache(cache, summary, index=True)
+
+    # include code compiled by this process outside of publish.publish_file()
+    hits, misses = bytecode.take_stats()
+    summary.code_hits += hits
+    summary.code_misses += misses
+
+    try:
+        if not options.get('dry_run') and bytecode.has_new():
+            bytecode.save(publish.get_bytecode_cache_path())
+    except:
+        if options.get('debug'):
+            output.traceback()
+
+        output.error('could not write bytecode cache file')
+        summary.errors += 1
+
+
+def select_tasks(tasks, relpaths, summary):
+    """Return the tasks (see find_files()) for the files with the specified
+    relative paths (see the --only option), counting an error in the summary
+    for each path that is not found in the Markdown directory.
+    """
+    wanted = set(os.path.normpath(relpath) for relpath in relpaths)
+    selected = [task for task in tasks if task[1] in wanted]
+
+    for relpath in sorted(wanted - set(task[1] for task in selected)):
+        output.error("'{}' is not in the Markdown directory".format(relpath))
+        summary.errors += 1
+
+    return selected
+
+
+def write_manifest(tasks, cache, summary):
+    import presto.shard as shard
+
+    path = shard.get_manifest_path(options.get('shard'))
+
+    try:
+        if not options.get('dry_run'):
+            shard.write_manifest(path, options.get('shard'), tasks, cache)
+    except:
+        if options.get('debug'):
+            output.traceback()
+
+        output.error("could not write manifest '{}'".format(path))
+        summary.errors += 1
+
+
+def build(template, cache, summary):
+    """Publish the files in the Markdown directory that have changed, remove
+    orphaned output files and save the cache files, updating the given cache
+    dictionary and Summary object. If the --only option is used, only the
+    specified files are published, and orphaned output files are not removed.
+    If the --shard option is used, only the files in the shard are published,
+    and a manifest is written instead of removing orphaned output files.
+    """
+    # the files and variables pages depend on may have changed since the last
+    # build in this process (see presto.watch)
+    deps.clear()
+    convert.clear_base_namespace()
+
+    tasks, expected_files = find_files(cache)
+
+    if options.get('only'):
+        tasks = select_tasks(tasks, options.get('only'), summary)
+
+    if options.get('shard'):
+        import presto.shard as shard
+
+        # the output files of the other shards are not known, so the output
+        # directory is cleaned up later (see shard.merge())
+        tasks = [task for task in tasks if shard.in_shard(task[1], options.get('shard'))]
+        publish_files(tasks, template, cache, summary)
+        save_caches(cache, summary)
+        write_manifest(tasks, cache, summary)
+        return
+
+    publish_files(tasks, template, cache, summary)
+
+    # with --only, several runs may be publishing different files at once, so
+    # none of them cleans up the output directory
+    if not options.get('only'):
+        remove_orphans(expected_files, cache, summary)
+
+    save_caches(cache, summary)
@@ -0,0 +1,367 @@
+"""This module provides the build database, the SQLite database kept in the
+cache file (see cache_file in presto.ini). For each file in the Markdown
+directory, it stores the hash and stat key of the file when it was last
+published, the inputs the page read (the dependency edges recorded by
+presto.deps), a digest of the output file, and how long the file took to
+publish. It also holds the metadata index (see presto.pageindex) and the
+settings that the output files were last produced with (see get_setting()).
+Changes are saved in transactions, in batches while files are being published,
+so that an interrupted run neither corrupts the database nor loses the work
+done before it was interrupted.
+
+Cache files written by older versions of Presto are text files with one line
+per file. Such a file is imported into a new database, which replaces it, the
+first time it is read.
+"""
+from __future__ import with_statement
+
+import os
+import io
+import json
+import sqlite3
+
+import six
+from six.moves.urllib.parse import unquote
+from six.moves.urllib.request import pathname2url
+
+
+_HEADER = b'SQLite format 3\x00'
+
+_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS files (
+        relpath TEXT PRIMARY KEY,
+        hash TEXT NOT NULL,
+        mtime_ns INTEGER,
+        size INTEGER,
+        ino INTEGER,
+        has_inputs INTEGER NOT NULL,
+        output_digest TEXT,
+        duration REAL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS inputs (
+        relpath TEXT NOT NULL,
+        key TEXT NOT NULL,
+        digest TEXT,
+        PRIMARY KEY (relpath, key)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS pages (
+        relpath TEXT PRIMARY KEY,
+        mtime_ns INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        ino INTEGER NOT NULL,
+        hash TEXT NOT NULL,
+        metadata TEXT NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS settings (
+        name TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )'''
+]
+
+# seconds to wait for another process (such as another run using --only) to
+# finish writing to the database before giving up
+_TIMEOUT = 60.0
+
+_conn = None                        # sqlite3.Connection to the database
+
+
+class Cache(dict):
+    """The contents of the build database, a dictionary mapping the relative
+    path of each Markdown file to a (hash, stat key, inputs, output digest,
+    duration) tuple, which remembers the paths whose entries have been set or
+    removed since the database was last saved. The stat key is described in
+    deps.get_stat_key(), and the inputs are the dictionary of other files
+    and variables the page read, as recorded by presto.deps. Entries imported
+    from an old cache file have only a hash, and None for everything else.
+    """
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.changed = set()
+
+    def __setitem__(self, relpath, entry):
+        if self.get(relpath) != entry:
+            dict.__setitem__(self, relpath, entry)
+            self.changed.add(relpath)
+
+    def __delitem__(self, relpath):
+        dict.__delitem__(self, relpath)
+        self.changed.add(relpath)
+
+    def pop(self, relpath, *default):
+        if relpath in self:
+            self.changed.add(relpath)
+
+        return dict.pop(self, relpath, *default)
+
+
+def _text(s):
+    # in Python 2, sqlite3 does not accept byte strings (such as paths found
+    # using os.walk()) that are not ASCII
+    if isinstance(s, six.binary_type):
+        return s.decode('utf-8')
+
+    return s
+
+
+def is_database(path):
+    with io.open(path, mode='rb') as f:
+        header = f.read(len(_HEADER))
+
+    # an empty file is a database that another process has only just created
+    # (and has not written to yet), which must not be replaced
+    return header in [_HEADER, b'']
+
+
+def read_text_cache(path):
+    """Read a cache file written by an older version of Presto and return a
+    dictionary of entries like those of a Cache. Older still cache files have
+    only two columns, so the stat keys and inputs of their entries are None.
+    """
+    cache = {}
+
+    with io.open(path) as f:
+        for line in f:
+            tokens = line.split()
+
+            if len(tokens) >= 5:
+                stat_key = tuple(int(t) for t in tokens[2:5])
+                inputs = {}
+
+                for token in tokens[5:]:
+                    key, _, digest = token.rpartition('=')
+                    inputs[unquote(key)] = digest
+            else:
+                stat_key = inputs = None
+
+            cache[tokens[0]] = (tokens[1], stat_key, inputs, None, None)
+
+    return cache
+
+
+def _connect(path):
+    # with isolation_level=None, transactions are begun explicitly, so that
+    # the schema can be created with BEGIN IMMEDIATE below
+    conn = sqlite3.connect(path, timeout=_TIMEOUT, isolation_level=None)
+
+    try:
+        # in write-ahead logging mode, several processes can read the database
+        # while one writes to it
+        conn.execute('PRAGMA journal_mode=WAL')
+
+        # take the write lock before reading the schema, so that processes
+        # creating the database at the same time wait for each other
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+        except:
+            conn.execute('ROLLBACK')
+            raise
+
+        conn.execute('COMMIT')
+    except:
+        conn.close()
+        raise
+
+    # go back to the default, where "with conn" commits a transaction
+    conn.isolation_level = ''
+    return conn
+
+
+def _connect_read_only(path):
+    """Open the database at the specified path without changing it: the
+    schema is not created, the journal mode is left alone and no lock is
+    taken, so that a dry run or a plan does not hold up a build running at
+    the same time. Return None if the database has no tables yet.
+    """
+    if six.PY2:
+        # Python 2's sqlite3 cannot open a database by URI, but since nothing
+        # is written here, opening it normally does not change it either
+        conn = sqlite3.connect(path, timeout=_TIMEOUT)
+    else:
+        uri = 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(path)))
+        conn = sqlite3.connect(uri, timeout=_TIMEOUT, uri=True)
+
+    try:
+        tables = set(name for name, in
+                     conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+    except:
+        conn.close()
+        raise
+
+    # another process may have only just created the database
+    if not tables.issuperset(['files', 'inputs', 'pages']):
+        conn.close()
+        return None
+
+    return conn
+
+
+def _write(conn, cache, relpaths):
+    with conn:
+        for relpath in relpaths:
+            conn.execute('DELETE FROM inputs WHERE relpath = ?', (_text(relpath),))
+
+            if relpath not in cache:
+                conn.execute('DELETE FROM files WHERE relpath = ?', (_text(relpath),))
+                continue
+
+            hash, stat_key, inputs, output_digest, duration = cache[relpath]
+            mtime_ns, size, ino = stat_key or (None, None, None)
+
+            conn.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (_text(relpath), hash, mtime_ns, size, ino, inputs is not None,
+                 output_digest, duration)
+            )
+
+            if inputs:
+                conn.executemany(
+                    'INSERT INTO inputs VALUES (?, ?, ?)',
+                    [(_text(relpath), _text(key), digest)
+                     for key, digest in inputs.items()]
+                )
+
+
+def load(path, dry_run=False):
+    """Open the build database at the specified path, creating it if it does
+    not exist, and return its contents as a Cache object. If the file at the
+    path is an old cache file, it is first imported into a new database,
+    which replaces it. In a dry run (which the "plan" command also uses), the
+    database is opened read-only, nothing is created or replaced, a missing
+    database is taken to be empty, and the returned Cache cannot be saved.
+    """
+    global _conn
+
+    if _conn is not None:
+        _conn.close()
+        _conn = None
+
+    if os.path.isfile(path) and not is_database(path):
+        cache = Cache(read_text_cache(path))
+
+        if dry_run:
+            return cache
+
+        # build the new database next to the old file, and then replace it,
+        # so that the old file is not lost if the import is interrupted
+        head, tail = os.path.split(path)
+        tmp_path = os.path.join(head, '.{}.{}.tmp'.format(tail, os.getpid()))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        conn = _connect(tmp_path)
+        _write(conn, cache, list(cache))
+        conn.close()
+
+        if hasattr(os, 'replace'):
+            os.replace(tmp_path, path)
+        else:
+            # os.rename() replaces the file atomically on POSIX systems
+            os.rename(tmp_path, path)
+
+    if dry_run:
+        if os.path.isfile(path):
+            _conn = _connect_read_only(path)
+
+        if _conn is None:
+            return Cache()
+
+    else:
+        _conn = _connect(path)
+
+    inputs = {}
+    for relpath, key, digest in _conn.execute('SELECT relpath, key, digest FROM inputs'):
+        inputs.setdefault(relpath, {})[key] = digest
+
+    cache = Cache()
+    for row in _conn.execute('SELECT * FROM files'):
+        relpath, hash, mtime_ns, size, ino, has_inputs, output_digest, duration = row
+
+        stat_key = None if mtime_ns is None else (mtime_ns, size, ino)
+        deps = inputs.get(relpath, {}) if has_inputs else None
+
+        dict.__setitem__(cache, relpath, (hash, stat_key, deps, output_digest, duration))
+
+    return cache
+
+
+def save(cache):
+    """Write the entries of the specified Cache object that have changed since
+    it was last saved to the build database, in one transaction.
+    """
+    if _conn is None:
+        raise ValueError('build database is not open')
+
+    if not cache.changed:
+        return
+
+    _write(_conn, cache, sorted(cache.changed))
+    cache.changed.clear()
+
+
+def load_index():
+    """Return the metadata index (see presto.pageindex) kept in the build
+    database, or an empty index if the database is not open.
+    """
+    index = {}
+
+    if _conn is None:
+        return index
+
+    for relpath, mtime_ns, size, ino, hash, metadata in _conn.execute('SELECT * FROM pages'):
+        index[relpath] = ((mtime_ns, size, ino), hash, json.loads(metadata))
+
+    return index
+
+
+def save_index(index, relpaths):
+    """Write the entries of the metadata index for the specified relative
+    paths to the build database, in one transaction, removing those that are
+    no longer in the index.
+    """
+    if _conn is None:
+        raise ValueError('build database is not open')
+
+    with _conn:
+        for relpath in sorted(relpaths):
+            if relpath not in index:
+                _conn.execute('DELETE FROM pages WHERE relpath = ?', (_text(relpath),))
+                continue
+
+            (mtime_ns, size, ino), hash, metadata = index[relpath]
+
+            _conn.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)',
+                (_text(relpath), mtime_ns, size, ino, hash,
+                 json.dumps(metadata, sort_keys=True))
+            )
+
+
+def get_setting(name):
+    """Return the value saved for the specified setting by save_setting(), or
+    None if there is none or the database is not open.
+    """
+    if _conn is None:
+        return None
+
+    try:
+        row = _conn.execute('SELECT value FROM settings WHERE name = ?', (name,)).fetchone()
+    except sqlite3.OperationalError:
+        # a database opened read-only (see load()) may predate the table
+        return None
+
+    return None if row is None else row[0]
+
+
+def save_setting(name, value):
+    """Save the value of the specified setting (a string) in the build
+    database, such as an option of presto.ini that every output file of the
+    last run was produced with.
+    """
+    if _conn is None:
+        raise ValueError('build database is not open')
+
+    with _conn:
+        _conn.execute('INSERT OR REPLACE INTO settings VALUES (?, ?)', (name, value))
@@ -0,0 +1,203 @@
+"""This module provides a persistent cache of the code objects compiled from the
+contents of {-sequences. Code objects are stored in marshalled form in a single
+file, keyed by a digest of the source code, the way it is compiled and the
+version of the Python interpreter. A {-sequence whose code was compiled during
+an earlier run, or earlier in this run, is not compiled again.
+
+Each entry remembers the last run (counting only runs that wrote the file)
+that used it. When the file would hold more than _MAX_ENTRIES entries, those
+used least recently are dropped, so that code compiled from {-sequences that
+have since been edited or removed does not pile up in the file.
+"""
+from __future__ import with_statement
+
+import sys
+import os
+import io
+import marshal
+import hashlib
+import threading
+
+import six
+
+try:
+    from importlib.util import MAGIC_NUMBER as _MAGIC
+except ImportError:
+    # Python 2
+    import imp
+    _MAGIC = imp.get_magic()
+
+
+_MAX_ENTRIES = 10000                # most entries kept in the file
+
+_loaded = {}                        # digest -> marshalled code, from the file
+_last_run = {}                      # digest -> last run that used the entry
+_run = 1                            # number of this run
+_code = {}                          # digest -> code object, for this process
+_new = {}                           # digest -> marshalled code, not yet saved
+_used = set()                       # digests of the entries used in this run
+_path = None                        # path of the file loaded into _loaded
+
+_new_lock = threading.Lock()        # guards changes to _new and _used
+
+# counts of get_code() calls by each thread since its last call to take_stats(),
+# as the "hits" and "misses" attributes
+_stats = threading.local()
+
+
+def load(path):
+    """Read the cache file at the specified path, unless it has already been
+    read by this process. A missing file, or one written by a different
+    version of Python, is treated as an empty cache.
+    """
+    global _path, _run
+
+    if path == _path:
+        return
+
+    _path = path
+    _run = 1
+    _loaded.clear()
+    _last_run.clear()
+
+    if not os.path.isfile(path):
+        return
+
+    with io.open(path, mode='rb') as f:
+        data = marshal.loads(f.read())
+
+    # files written by older versions of Presto have no run numbers
+    if len(data) != 3 or data[0] != _MAGIC:
+        return
+
+    magic, last_run, entries = data
+    _run = last_run + 1
+
+    for digest, (run, code) in entries.items():
+        _loaded[digest] = code
+        _last_run[digest] = run
+
+
+def save(path):
+    """Write the entries loaded from the cache file together with the new
+    entries (see add()) to the cache file at the specified path, dropping the
+    least recently used entries if there are more than _MAX_ENTRIES. The file
+    is written under a temporary name that then replaces it, so that a run
+    that is interrupted (or another run saving at the same time) cannot leave
+    a truncated cache file behind.
+    """
+    global _run
+
+    with _new_lock:
+        _loaded.update(_new)
+        _new.clear()
+
+        for digest in _used:
+            _last_run[digest] = _run
+
+        _used.clear()
+
+    for digest in _loaded:
+        _last_run.setdefault(digest, _run)
+
+    if len(_loaded) > _MAX_ENTRIES:
+        keep = sorted(_loaded, key=lambda digest: _last_run[digest])[-_MAX_ENTRIES:]
+
+        for digest in set(_loaded) - set(keep):
+            del _loaded[digest]
+            del _last_run[digest]
+
+    entries = {digest: (_last_run[digest], code) for digest, code in _loaded.items()}
+
+    head, tail = os.path.split(path)
+    tmp_path = os.path.join(head, '.{}.{}.tmp'.format(tail, os.getpid()))
+
+    try:
+        with io.open(tmp_path, mode='wb') as f:
+            f.write(marshal.dumps((_MAGIC, _run, entries)))
+
+        if hasattr(os, 'replace'):
+            os.replace(tmp_path, path)
+        else:
+            # os.rename() replaces the file atomically on POSIX systems
+            os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    # a later save by this process (see presto.watch) is a new run
+    _run += 1
+
+
+def get_code(source, mode, flags=0):
+    """Like compile(source, '<string>', mode, flags, True), but return a cached
+    code object if there is one. Exceptions raised by compile() are raised
+    here, and are not cached.
+    """
+    h = hashlib.md5()
+    h.update(_MAGIC)
+    h.update(sys.version.encode('utf-8'))
+    h.update('{}:{}:'.format(mode, flags).encode('utf-8'))
+    h.update(source.encode('utf-8') if isinstance(source, six.text_type) else source)
+    digest = h.hexdigest()
+
+    code = _code.get(digest)
+    if code is not None:
+        _stats.hits = getattr(_stats, 'hits', 0) + 1
+    else:
+        data = _loaded.get(digest) or _new.get(digest)
+        if data is not None:
+            _stats.hits = getattr(_stats, 'hits', 0) + 1
+            code = marshal.loads(data)
+        else:
+            _stats.misses = getattr(_stats, 'misses', 0) + 1
+            code = compile(source, '<string>', mode, flags, True)
+
+            with _new_lock:
+                _new[digest] = marshal.dumps(code)
+
+        _code[digest] = code
+
+    if digest not in _used:
+        with _new_lock:
+            _used.add(digest)
+
+    return code
+
+
+def take_new():
+    """Return a (new, used) tuple, where new is a dictionary of the entries
+    compiled by this process that are not in the cache file, and used is a
+    set of the digests of the entries used by this process, and forget both
+    (the code objects stay in memory).
+    """
+    with _new_lock:
+        new = dict(_new)
+        used = set(_used)
+        _new.clear()
+        _used.clear()
+
+    return new, used
+
+
+def add(entries, used):
+    """Add a (new, used) tuple returned by take_new() in another process to
+    the entries that will be written by save().
+    """
+    with _new_lock:
+        _new.update(entries)
+        _used.update(used)
+
+
+def has_new():
+    return bool(_new)
+
+
+def take_stats():
+    """Return a (hits, misses) tuple counting calls to get_code() by this
+    thread since its last call to this function.
+    """
+    stats = (getattr(_stats, 'hits', 0), getattr(_stats, 'misses', 0))
+    _stats.hits = _stats.misses = 0
+    return stats
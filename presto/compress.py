@@ -0,0 +1,225 @@
+"""This module provides gzip sidecars (the --gzip option): for each HTML file in
+the output directory, a copy compressed with gzip is kept next to it (e.g.,
+foo.html.gz next to foo.html), which web servers can send instead of the HTML
+file to clients that accept it. A sidecar is given the modification time of
+its HTML file, and is only written again when it does not exist or the times
+differ (even if the HTML file is older, such as one restored from a backup),
+so only HTML files that changed are compressed again. Every sidecar is written
+again when the compression level changes, which is detected using the level
+saved in the build database (see builddb.get_setting()). The files are
+compressed by a pool of threads while other pages are being converted. HTML
+files smaller than the minimum size are not worth compressing, and any
+sidecars they have are removed.
+
+Sidecars are kept when the "gzip" option is set in presto.ini, or when the
+--gzip option is used. Otherwise, the sidecar of each HTML file that is
+written is removed, so that a web server never sends an out-of-date copy.
+The compression level and the minimum size are given by the gzip_level and
+gzip_min_size options in presto.ini.
+"""
+from __future__ import with_statement
+
+import os
+import io
+import gzip
+import shutil
+
+import presto.config as config
+import presto.output as output
+import presto.options as options
+import presto.builddb as builddb
+
+
+_DEFAULT_LEVEL = 9
+_DEFAULT_MIN_SIZE = 256             # bytes
+
+
+def _get_int(name, default, minimum, maximum=None):
+    """Return the integer given by the specified option in presto.ini, or the
+    default if it is not set. Raise ValueError, with a message describing the
+    problem, if it is not an integer in the allowed range.
+    """
+    value = config.get(name)
+
+    if value is None or not value.strip():
+        return default
+
+    try:
+        number = int(value)
+    except ValueError:
+        number = None
+
+    if number is None or number < minimum or (maximum is not None and number > maximum):
+        if maximum is None:
+            allowed = 'an integer of at least {}'.format(minimum)
+        else:
+            allowed = 'an integer from {} to {}'.format(minimum, maximum)
+
+        raise ValueError('invalid value for configuration variable "{}": {!r} '
+                         '(expected {})'.format(name, value, allowed))
+
+    return number
+
+
+def _mtime(st):
+    """Return the modification time in the given os.stat() result, in
+    nanoseconds if the platform gives them, or else in microseconds (which
+    os.utime() keeps in Python 2).
+    """
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is not None:
+        return mtime_ns
+
+    return int(round(st.st_mtime * 1000000))
+
+
+def is_enabled():
+    if options.get('gzip'):
+        return True
+
+    return (config.get('gzip') or '').strip().lower() in ['1', 'yes', 'true', 'on']
+
+
+def sidecar_path(path):
+    return path + '.gz'
+
+
+def remove_sidecar(path):
+    """Remove the gzip sidecar of the HTML file at the specified path, if it
+    has one, and return True if it did.
+    """
+    gz_path = sidecar_path(path)
+
+    if not os.path.lexists(gz_path):
+        return False
+
+    os.remove(gz_path)
+    return True
+
+
+def write_sidecar(path, level, st=None):
+    """Write the gzip sidecar of the file at the specified path, under a
+    temporary name that then replaces the old sidecar (if any). If an
+    os.stat() result of the file is given, the sidecar is given its
+    modification time, so that it can be told whether the file has changed
+    since (see Compressor.add()).
+    """
+    gz_path = sidecar_path(path)
+    head, tail = os.path.split(gz_path)
+
+    # the leading '.' makes the cleanup of the output directory ignore this
+    # file, if it is ever left behind
+    tmp_path = os.path.join(head, '.{}.{}.tmp'.format(tail, os.getpid()))
+
+    try:
+        with io.open(path, mode='rb') as f:
+            with io.open(tmp_path, mode='wb') as raw:
+                # a fixed timestamp and no file name make the sidecar depend
+                # only on the contents of the file
+                gz = gzip.GzipFile(filename='', mode='wb', compresslevel=level,
+                                   fileobj=raw, mtime=0)
+                with gz:
+                    shutil.copyfileobj(f, gz)
+
+        if st is not None:
+            if hasattr(st, 'st_mtime_ns'):
+                os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+            else:
+                # Python 2's os.utime() truncates the time to microseconds, so
+                # aim for the middle of the microsecond that _mtime() rounds to
+                os.utime(tmp_path, (st.st_atime, (_mtime(st) + 0.5) / 1000000.0))
+
+        if hasattr(os, 'replace'):
+            os.replace(tmp_path, gz_path)
+        else:
+            # os.rename() replaces the file atomically on POSIX systems
+            os.rename(tmp_path, gz_path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class Compressor(object):
+    """Brings the gzip sidecars of HTML files up to date using a pool of
+    threads. Call add() with the path of each HTML file that was published
+    (or left unchanged), and finish() once all have been added.
+    """
+
+    def __init__(self):
+        """Raise ValueError if the gzip_level or gzip_min_size option in
+        presto.ini is not valid.
+        """
+        from multiprocessing.pool import ThreadPool
+        import multiprocessing
+
+        self.level = _get_int('gzip_level', _DEFAULT_LEVEL, 1, 9)
+        self.min_size = _get_int('gzip_min_size', _DEFAULT_MIN_SIZE, 0)
+
+        # whether the existing sidecars may have been written with another
+        # compression level, in which case all of them are written again
+        self.level_changed = builddb.get_setting('gzip_level') != str(self.level)
+
+        self.pool = ThreadPool(multiprocessing.cpu_count())
+        self.pending = []
+
+    def add(self, path):
+        """Compress the HTML file at the specified path in the background, if
+        its sidecar is missing or out of date, or remove its sidecar if the
+        file is smaller than the minimum size.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            # the file was not written (e.g., in a dry run)
+            return
+
+        gz_path = sidecar_path(path)
+
+        try:
+            gz_mtime = _mtime(os.stat(gz_path))
+        except OSError:
+            gz_mtime = None
+
+        if st.st_size < self.min_size:
+            if gz_mtime is not None:
+                self.pending.append((gz_path, self.pool.apply_async(os.remove, (gz_path,))))
+        elif gz_mtime != _mtime(st) or self.level_changed:
+            self.pending.append((gz_path, self.pool.apply_async(write_sidecar,
+                                                                (path, self.level, st))))
+
+    def finish(self, summary, complete=True):
+        """Wait for the sidecars to be written, counting an error in the
+        summary for each that could not be. If complete is True (every HTML
+        file has been added) and every sidecar has been written with the
+        current compression level, the level is saved in the build database.
+        """
+        self.pool.close()
+        self.pool.join()
+
+        failed = False
+
+        for gz_path, pending in self.pending:
+            try:
+                pending.get()
+            except:
+                if options.get('debug'):
+                    output.traceback()
+
+                output.error("could not update gzip sidecar '{}'".format(gz_path))
+                summary.errors += 1
+                failed = True
+
+        self.pending = []
+
+        # with --only, the sidecars of the other pages were not looked at
+        if self.level_changed and complete and not failed and not options.get('only'):
+            try:
+                builddb.save_setting('gzip_level', str(self.level))
+                self.level_changed = False
+            except:
+                if options.get('debug'):
+                    output.traceback()
+
+                output.error('could not save gzip level in cache file')
+                summary.errors += 1
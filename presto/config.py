@@ -18,17 +18,26 @@ _ini_containing_dir = None          # path of directory containing presto.ini
 def load(path):
     global _conf, _ini_path, _ini_containing_dir
 
-    _conf = configparser.ConfigParser()
+    # the loaded configuration is only replaced once the new one is known to
+    # be valid (in watch mode, presto.ini is loaded again after each change)
+    conf = configparser.ConfigParser()
+
+    try:
+        found = conf.read(path)
+    except configparser.Error as e:
+        output.error('could not parse configuration file: {}'.format(e))
+        sys.exit(1)
 
-    if not _conf.read(path):
+    if not found:
         output.error('could not read configuration file: {}'.format(path))
         sys.exit(1)
 
     else:
-        if not _conf.has_section('presto'):
+        if not conf.has_section('presto'):
             output.error('presto.ini has no [presto] section, which is required')
             sys.exit(2)
 
+        _conf = conf
         _ini_path = os.path.abspath(path)
         _ini_containing_dir = os.path.dirname(_ini_path)
 
@@ -4,138 +4,629 @@ when a Markdown draft should be converted to HTML.
 from __future__ import print_function
 
 import sys
+import time
+import heapq
 import datetime
 import re
+import threading
+import __future__
 
 import six
 from six.moves import cStringIO
 
+if not six.PY2:
+    from collections.abc import KeysView, ItemsView, ValuesView
+
 import presto.functions as functions
 import presto.options as options
 import presto.config as config
 import presto.output as output
+import presto.deps as deps
+import presto.bytecode as bytecode
+import presto.minify as minify
+import presto.watchdog as watchdog
 
 BRACE_PATTERN = re.compile(r'(\n[ \t]*)?{([~=!])(.*?)\2}', re.DOTALL)
 ESCAPE_PATTERN = re.compile(r'\\([{}~=!])')
 
+_EVAL_FLAGS = __future__.print_function.compiler_flag
+
+_DELIMITERS = {'!': '{! ... !}', '~': '{~ ... ~}', '=': '{= ... =}'}
+
+_clock = getattr(time, 'perf_counter', time.time)
+
 
 class BracketError(ValueError):
     pass
 
 
-def eval_brackets(s, errors, locals_, globals_):
-    def sub(match):
-        ws_before = match.group(1)
-        kind = match.group(2)
-        inner = match.group(3)
+class _StreamProxy(object):
+    """A stand-in for sys.stdin or sys.stdout that forwards everything to the
+    stream that the current thread is capturing to (see _start_capture()), or
+    if it is not capturing, to the stream it replaced. This lets {-sequences
+    of different pages be evaluated at the same time by different threads.
+    """
 
-        if ws_before:
-            # remove leading \n
-            ws_before = ws_before[1:]
-        else:
-            ws_before = ''
+    def __init__(self, name, stream):
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_stream', stream)
 
-        in_, out_ = cStringIO(), cStringIO()
-        sys.stdin = in_
-        sys.stdout = out_
+    def _target(self):
+        stream = getattr(_captured, self._name, None)
+        return self._stream if stream is None else stream
 
-        if kind == '!':
-            # code block
-            inner = dedent(inner, len(ws_before))
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
 
-            try:
-                six.exec_(inner, globals_, locals_)
-            except Exception as e:
-                sys.stdin = sys.__stdin__
-                sys.stdout = sys.__stdout__
+    def __setattr__(self, name, value):
+        # e.g., the softspace attribute used by Python 2's print statement
+        setattr(self._target(), name, value)
 
-                import traceback
-                e_type, e_value, e_tb = sys.exc_info()
-                e_str = traceback.format_exception(e_type, e_value, None, 0)[0].strip()
 
-                errors.append('error occurred executing {! ... !}: ' + e_str)
+# the streams that each thread is capturing to, as the "stdin" and "stdout"
+# attributes
+_captured = threading.local()
 
-                if options.get('debug'):
-                    output.traceback()
+# for the page each thread is converting, the time limit of each {-sequence
+# (see presto.watchdog) as the "sequence_limit" attribute, and a list of
+# (seconds, location) tuples for the {-sequences evaluated so far as the
+# "times" attribute
+_page = threading.local()
 
-                if options.get('use_empty'):
-                    return ''
-                else:
-                    raise BracketError
 
-            sys.stdin = sys.__stdin__
-            sys.stdout = sys.__stdout__
+def _start_capture():
+    """Make sys.stdin an empty stream and capture sys.stdout for the current
+    thread only, and return a (stdout, saved) tuple, where stdout is the
+    stream output is captured to and saved is needed by _stop_capture().
+    """
+    for name in ['stdin', 'stdout']:
+        if not isinstance(getattr(sys, name), _StreamProxy):
+            setattr(sys, name, _StreamProxy(name, getattr(sys, name)))
+
+    saved = (getattr(_captured, 'stdin', None), getattr(_captured, 'stdout', None))
+    _captured.stdin, _captured.stdout = cStringIO(), cStringIO()
+    return _captured.stdout, saved
+
+
+def _stop_capture(saved):
+    _captured.stdin, _captured.stdout = saved
+
+
+class _RecordingDict(dict):
+    """A dictionary that records a dependency on a configuration variable (see
+    presto.deps) whenever one of the specified variables is looked up in it,
+    whether with [], get() or "in". Listing the dictionary (by iterating over
+    it or using keys(), items() or values()) records a dependency on every
+    variable in it, and on which variables are defined. This works for names
+    used in {-sequences, since the namespace is passed to exec and eval as the
+    local namespace, where names are looked up using __getitem__.
+    """
+
+    def __init__(self, variables, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._variables = variables
+
+    def _record(self, key):
+        if key in self._variables:
+            deps.record_variable(key, self._variables[key])
+
+    def _record_all(self):
+        for key in dict.keys(self):
+            self._record(key)
+
+        deps.record_variable_names(self._variables)
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        self._record(key)
+        return value
+
+    def get(self, key, default=None):
+        self._record(key)
+        return dict.get(self, key, default)
+
+    def __contains__(self, key):
+        self._record(key)
+        return dict.__contains__(self, key)
+
+    def __iter__(self):
+        self._record_all()
+        return dict.__iter__(self)
+
+    def keys(self):
+        self._record_all()
+        return dict.keys(self)
+
+    def items(self):
+        self._record_all()
+        return dict.items(self)
+
+    def values(self):
+        self._record_all()
+        return dict.values(self)
+
+    if six.PY2:
+        def iterkeys(self):
+            self._record_all()
+            return dict.iterkeys(self)
+
+        def iteritems(self):
+            self._record_all()
+            return dict.iteritems(self)
+
+        def itervalues(self):
+            self._record_all()
+            return dict.itervalues(self)
+
+        def has_key(self, key):
+            return key in self
+
+    def copy(self):
+        return dict(self.items())
+
+
+class _ReadOnlyRecordingDict(_RecordingDict):
+    """A _RecordingDict that cannot be changed, so that it can be shared by
+    every page without one page's changes being seen by another.
+    """
+
+    def _record(self, key):
+        # every key of this dictionary is a variable, so looking up one that
+        # is not defined depends on it staying undefined
+        deps.record_variable(key, self._variables.get(key))
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('this dictionary cannot be changed')
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+
+class _PageNamespace(dict):
+    """The namespace of a page, holding the names defined for the page (such as
+    its metadata) and by its {-sequences, layered over the base namespace that
+    is shared by every page (see get_base_namespace()). Names are only ever
+    stored in the page's own layer, so nothing a page defines is seen by any
+    other page, and the base namespace is not copied for each page.
+
+    Otherwise, it behaves like a copy of the base namespace that the page's
+    names were added to: the names of the base namespace can be looked up,
+    tested with "in", listed (by iterating over the namespace or using keys(),
+    items() or dir()) and deleted, which hides them from the page only.
+    """
+
+    def __init__(self, base, *args, **kwargs):
+        dict.__init__(self)
+        self._base = base
+        self._deleted = set()       # names of the base namespace deleted by
+                                    # the page
+        self.update(*args, **kwargs)
+
+    def _in_base(self, key):
+        # not "in", which would record a dependency on a variable the page
+        # did not ask about (see _RecordingDict)
+        return dict.__contains__(self._base, key) and key not in self._deleted
+
+    def __missing__(self, key):
+        if key in self._deleted:
+            raise KeyError(key)
+
+        return self._base[key]
+
+    def __setitem__(self, key, value):
+        self._deleted.discard(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        if dict.__contains__(self, key):
+            dict.__delitem__(self, key)
+        elif not self._in_base(key):
+            raise KeyError(key)
+
+        if dict.__contains__(self._base, key):
+            self._deleted.add(key)
+
+    def __contains__(self, key):
+        if dict.__contains__(self, key):
+            return True
+
+        return key not in self._deleted and key in self._base
 
-            if ws_before:
-                return '\n' + ws_before + indent(out_.getvalue(), ws_before)
+    def __iter__(self):
+        for key in dict.__iter__(self):
+            yield key
+
+        for key in self._base:
+            if key not in self._deleted and not dict.__contains__(self, key):
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    if six.PY2:
+        # dir() and locals() need lists in Python 2
+        def keys(self):
+            return list(self)
+
+        def items(self):
+            return [(key, self[key]) for key in self]
+
+        def values(self):
+            return [self[key] for key in self]
+    else:
+        def keys(self):
+            return KeysView(self)
+
+        def items(self):
+            return ItemsView(self)
+
+        def values(self):
+            return ValuesView(self)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+
+        del self[key]
+        return value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        dict.clear(self)
+        self._deleted.update(dict.keys(self._base))
+
+    def copy(self):
+        return dict(self.items())
+
+
+_base_namespace = None
+
+
+def get_base_namespace():
+    """Return the namespace shared by every page converted until the next call
+    to clear_base_namespace(), which contains the functions in the functions
+    module, the variables defined in the config file, and the "config"
+    dictionary of those variables. It is built on first use, so that it is not
+    rebuilt for each page.
+    """
+    global _base_namespace
+
+    if _base_namespace is None:
+        ini_variables = config.get_variables()
+
+        base = _RecordingDict(ini_variables)
+
+        # put the utility functions in the functions module in scope
+        base.update(get_functions(functions))
+
+        # put the variables defined in the config file in scope
+        base.update(ini_variables)
+
+        # make the config file's variables available under "config"
+        base.update({'config': _ReadOnlyRecordingDict(ini_variables, ini_variables)})
+
+        _base_namespace = base
+
+    return _base_namespace
+
+
+def clear_base_namespace():
+    """Forget the base namespace, so that changes made to the config file since
+    it was built will be seen.
+    """
+    global _base_namespace
+    _base_namespace = None
+
+
+def parse_sequence(match):
+    """Given a match of BRACE_PATTERN, return a (ws_before, kind, code) tuple
+    for the {-sequence, where ws_before is the whitespace preceding the opening
+    brace on its line, kind is one of '~', '=' or '!', and code is the compiled
+    code object for the contents of the sequence. If the contents cannot be
+    compiled, code is the exception that was raised, so that the error can be
+    reported when the sequence is evaluated, as if it had been compiled then.
+    """
+    ws_before = match.group(1)
+    kind = match.group(2)
+    inner = match.group(3)
+
+    if ws_before:
+        # remove leading \n
+        ws_before = ws_before[1:]
+    else:
+        ws_before = ''
+
+    try:
+        if kind == '!':
+            # like six.exec_() with a string, do not use this module's
+            # __future__ statements (this matters only in Python 2)
+            code = bytecode.get_code(dedent(inner, len(ws_before)), 'exec')
+        else:
+            # like eval() with a string, use this module's __future__ statements
+            code = bytecode.get_code(inner.strip(), 'eval', _EVAL_FLAGS)
+    except Exception as e:
+        code = e
+
+    return ws_before, kind, code
+
+
+def _run_sequence(kind, code, globals_, locals_, location):
+    """Execute or evaluate the code of a {-sequence within its time limit,
+    recording how long it took, and return the value of an expression.
+    """
+    start = _clock()
+
+    try:
+        with watchdog.limit('sequence', getattr(_page, 'sequence_limit', None), location):
+            if kind == '!':
+                six.exec_(code, globals_, locals_)
             else:
-                return indent(out_.getvalue(), ws_before)
+                return eval(code, globals_, locals_)
+    finally:
+        times = getattr(_page, 'times', None)
+        if times is not None:
+            times.append((_clock() - start, location))
+
+
+def _timed_out(e, kind, errors, location):
+    """Report a {-sequence that ran out of time, given the
+    watchdog.TimeLimitExceeded exception, and return the string it should be
+    replaced with, or raise BracketError. If the page ran out of time,
+    BracketError is always raised, so that the page is not converted.
+    """
+    prefix = '' if location is None else location + ': '
+
+    if isinstance(e, watchdog.PageTimeLimitExceeded):
+        errors.append('{}page took longer than {:g} seconds, while evaluating {}'.format(
+            prefix, watchdog.get_limit('page_time_limit'), _DELIMITERS[kind]
+        ))
+        raise BracketError
+
+    errors.append('{}{} took longer than {:g} seconds'.format(
+        prefix, _DELIMITERS[kind], _page.sequence_limit
+    ))
+
+    if options.get('use_empty'):
+        return ''
+    else:
+        raise BracketError
+
+
+def eval_sequence(sequence, errors, locals_, globals_, location=None):
+    """Evaluate a {-sequence, given as a tuple returned by parse_sequence(), and
+    return the string it should be replaced with. If evaluation fails, the
+    error is appended to the errors list, and either the empty string is
+    returned (if the --use-empty option is used) or BracketError is raised.
+    The location of the sequence (such as "line 12") is used to report it if
+    it runs out of time (see presto.watchdog) or is one of the slowest.
+    """
+    ws_before, kind, code = sequence
 
-        elif kind in ['~', '=']:
-            # evaluating an expression
-            inner = inner.strip()
+    out_, saved = _start_capture()
 
-            try:
-                rv = eval(inner, globals_, locals_)
-            except Exception as e:
-                sys.stdin = sys.__stdin__
-                sys.stdout = sys.__stdout__
+    if kind == '!':
+        # code block
+        try:
+            if isinstance(code, Exception):
+                raise code
 
-                import traceback
-                e_type, e_value, e_tb = sys.exc_info()
-                e_str = traceback.format_exception(e_type, e_value, None, 0)[0].strip()
+            _run_sequence(kind, code, globals_, locals_, location)
+        except watchdog.TimeLimitExceeded as e:
+            _stop_capture(saved)
+            return _timed_out(e, kind, errors, location)
+        except Exception as e:
+            _stop_capture(saved)
 
-                if kind == '~':
-                    errors.append('error occurred evaluating {~ ... ~}: ' + e_str)
-                elif kind == '=':
-                    errors.append('error occurred evaluating {= ... =}: ' + e_str)
+            import traceback
+            e_type, e_value, e_tb = sys.exc_info()
+            e_str = traceback.format_exception(e_type, e_value, None, 0)[0].strip()
 
-                if options.get('debug'):
-                    output.traceback()
+            errors.append('error occurred executing {! ... !}: ' + e_str)
 
-                if options.get('use_empty'):
-                    return ''
-                else:
-                    raise BracketError
+            if options.get('debug'):
+                output.traceback()
 
+            if options.get('use_empty'):
                 return ''
+            else:
+                raise BracketError
 
-            sys.stdin = sys.__stdin__
-            sys.stdout = sys.__stdout__
+        _stop_capture(saved)
+
+        if ws_before:
+            return '\n' + ws_before + indent(out_.getvalue(), ws_before)
+        else:
+            return indent(out_.getvalue(), ws_before)
+
+    elif kind in ['~', '=']:
+        # evaluating an expression
+        try:
+            if isinstance(code, Exception):
+                raise code
+
+            rv = _run_sequence(kind, code, globals_, locals_, location)
+        except watchdog.TimeLimitExceeded as e:
+            _stop_capture(saved)
+            return _timed_out(e, kind, errors, location)
+        except Exception as e:
+            _stop_capture(saved)
+
+            import traceback
+            e_type, e_value, e_tb = sys.exc_info()
+            e_str = traceback.format_exception(e_type, e_value, None, 0)[0].strip()
 
             if kind == '~':
-                str_out = repr(rv)
+                errors.append('error occurred evaluating {~ ... ~}: ' + e_str)
             elif kind == '=':
-                # unicode() in Python 2, str() in Python 3
-                str_out = six.text_type(rv)
+                errors.append('error occurred evaluating {= ... =}: ' + e_str)
+
+            if options.get('debug'):
+                output.traceback()
 
-            if ws_before:
-                return '\n' + ws_before + str_out
+            if options.get('use_empty'):
+                return ''
             else:
-                return str_out
+                raise BracketError
+
+            return ''
+
+        _stop_capture(saved)
+
+        if kind == '~':
+            str_out = repr(rv)
+        elif kind == '=':
+            # unicode() in Python 2, str() in Python 3
+            str_out = six.text_type(rv)
+
+        if ws_before:
+            return '\n' + ws_before + str_out
+        else:
+            return str_out
+
+
+def _numbered(s, matches):
+    """Given a string and an iterable of the matches of BRACE_PATTERN in it, in
+    order, generate a (match, line number) tuple for each match, where the
+    line number is that of its opening brace.
+    """
+    pos = 0
+    lineno = 1
+
+    for match in matches:
+        lineno += s.count('\n', pos, match.start())
+        pos = match.start()
+
+        # the pattern includes the newline before the brace, if it begins a line
+        yield match, lineno + 1 if match.group(1) else lineno
+
 
-    # from top to bottom, evaluate {-sequences using above function
+def eval_brackets(s, errors, locals_, globals_, where='line'):
+    """Return the string with its {-sequences evaluated, or None if an error
+    occurred. The location of each sequence is its line number, with the
+    specified word before it (such as "template line").
+    """
+    parts = []
+    pos = 0
+
+    # from top to bottom, evaluate {-sequences
     try:
-        s_evald = re.sub(BRACE_PATTERN, sub, s)
+        for match, lineno in _numbered(s, BRACE_PATTERN.finditer(s)):
+            parts.append(s[pos:match.start()])
+            parts.append(eval_sequence(parse_sequence(match), errors, locals_, globals_,
+                                       '{} {}'.format(where, lineno)))
+            pos = match.end()
     except BracketError:
         return None
 
-    return s_evald
+    parts.append(s[pos:])
+    return ''.join(parts)
+
+
+class Template(object):
+    """A template string (such as the contents of the template file) that has
+    been split into literal text and compiled {-sequences ahead of time, so
+    that it can be rendered for many pages without searching it for
+    {-sequences or compiling their contents again. The {= content =} sequence
+    is compiled like any other.
+    """
+
+    def __init__(self, source):
+        self.source = source
+
+        # strings of literal text alternating with parse_sequence() tuples
+        self._chunks = []
+        self._locations = []        # location of each {-sequence
+
+        pos = 0
+        for match, lineno in _numbered(source, BRACE_PATTERN.finditer(source)):
+            self._chunks.append(source[pos:match.start()])
+            self._chunks.append(parse_sequence(match))
+            self._locations.append('template line {}'.format(lineno))
+            pos = match.end()
+
+        self._chunks.append(source[pos:])
 
+    def __getstate__(self):
+        # code objects cannot be pickled, so send only the source to worker
+        # processes and compile it again there
+        return {'source': self.source}
 
-def md_to_html(md, template_str, f, extra_metadata={}):
-    """Given a markdown.Markdown object, a string containing an HTML template,
-    and a file object open for reading that corresponds to a file containing
+    def __setstate__(self, state):
+        self.__init__(state['source'])
+
+    def render(self, errors, locals_, globals_):
+        """Like eval_brackets(), return the template with its {-sequences
+        evaluated, or None if an error occurred.
+        """
+        parts = []
+
+        try:
+            for i, chunk in enumerate(self._chunks):
+                if i % 2 == 0:
+                    parts.append(chunk)
+                else:
+                    parts.append(eval_sequence(chunk, errors, locals_, globals_,
+                                               self._locations[i // 2]))
+        except BracketError:
+            return None
+
+        return ''.join(parts)
+
+
+def md_to_html(md, template, f, extra_metadata={}):
+    """Given a markdown.Markdown object, an HTML template (a Template object or
+    a string), and a file object open for reading that corresponds to a file containing
     Markdown (with {-sequences), return an HTML string with the Markdown
     elements converted to HTML and the code within the {-sequences executed.
     An "extra" metadata dictionary can also be specified, and its contents
-    will be merged with the file's metadata.
+    will be merged with the file's metadata. If the page or one of its
+    {-sequences takes longer than its time limit (see presto.watchdog), the
+    page is not converted.
     """
+    errors = []
+
+    _page.sequence_limit = watchdog.get_limit('sequence_time_limit')
+    _page.times = []
+    page_limit = watchdog.get_limit('page_time_limit')
+
+    saved = (getattr(_captured, 'stdin', None), getattr(_captured, 'stdout', None))
+
+    try:
+        with watchdog.limit('page', page_limit):
+            return _md_to_html(md, template, f, extra_metadata, errors)
+    except watchdog.PageTimeLimitExceeded:
+        # the time ran out outside of any {-sequence (those are reported by
+        # eval_sequence()), possibly while output was being captured
+        _stop_capture(saved)
+
+        errors.append('page took longer than {:g} seconds'.format(page_limit))
+        return None, errors
+
+
+def _md_to_html(md, template, f, extra_metadata, errors):
     body_md = f.read()
 
-    # convert using the markdown.Markdown object, just to obtain metadata
-    md.convert(body_md)
-    metadata = md.Meta
+    # run only the metadata preprocessor, not a full conversion
+    metadata = get_metadata(md, body_md)
 
     if 'path' in metadata:
         # add directories to the Python module search path, so import
@@ -143,41 +634,22 @@ def md_to_html(md, template_str, f, extra_metadata={}):
         for d in metadata['path']:
             sys.path.append(d)
 
-    # in Python 2, the variable names and value(s) are unicode(), since they
-    # come from Python-Markdown that way; we will use str() convert them to
-    # regular strings and accept the fact that non-ASCII characters in them
-    # will produce an issue (in Python 3 this does nothing)
-    new_metadata = {}
-    for var, val in metadata.items():
-        if len(val) == 1:
-            # e.g., foo: bar (only one value for the variable "foo")
-            new_metadata.update({str(var): str(val[0])})
-        else:
-            new_metadata.update({str(var): [str(s) for s in val]})
+    new_metadata = normalize_metadata(metadata)
 
     if extra_metadata:
         new_metadata.update(extra_metadata)
 
-    globals_ = {}
-    locals_ = {}
-    errors = []
-
-    # put the utility functions in the functions module in scope
-    globals_.update(get_functions(functions))
-
-    ini_variables = config.get_variables()
-
-    # put the variables defined in the config file in scope
-    globals_.update(ini_variables)
-
     draft_metadata = {var: val for var, val in new_metadata.items()}
 
+    # names looked up in the page's own layer (such as variables shadowed by
+    # the draft's metadata) are not read from the config file, so looking them
+    # up is not a dependency on the config file
+    globals_ = _PageNamespace(get_base_namespace())
+    locals_ = {}
+
     # make the all the metadata available under "metadata"
     globals_.update({'metadata': draft_metadata})
 
-    # make the config file's variables available under "config"
-    globals_.update({'config': ini_variables})
-
     # put the draft metadata in scope
     globals_.update(draft_metadata)
 
@@ -192,7 +664,10 @@ def md_to_html(md, template_str, f, extra_metadata={}):
 
     globals_.update({'content': body_html})
 
-    page_evald = eval_brackets(template_str, errors, globals_, locals_)
+    if isinstance(template, Template):
+        page_evald = template.render(errors, globals_, locals_)
+    else:
+        page_evald = eval_brackets(template, errors, globals_, locals_, 'template line')
 
     if page_evald is None:
         return None, errors
@@ -203,15 +678,107 @@ def md_to_html(md, template_str, f, extra_metadata={}):
 
     page_evald_deescaped = re.sub(ESCAPE_PATTERN, deescape, page_evald)
 
+    # the page is written again if the "minify" option is changed
+    deps.record_config('minify')
+
+    if minify.is_enabled():
+        page_evald_deescaped = minify.minify(page_evald_deescaped)
+
     return page_evald_deescaped, errors
 
 
+def take_sequence_times(n):
+    """Return a list of (seconds, location) tuples for the n slowest
+    {-sequences of the page last converted by this thread, slowest first.
+    """
+    times, _page.times = getattr(_page, 'times', None) or [], None
+    return heapq.nlargest(n, times)
+
+
+def get_metadata(md, body_md):
+    """Given a markdown.Markdown object and a string containing Markdown, run
+    the object's preprocessors in order, up to and including the "meta"
+    preprocessor, and return the metadata dictionary it produced. Unlike
+    md.convert(), this does not parse blocks, run inline patterns or serialize
+    anything, so it is cheap to call before the real conversion.
+    """
+    md.Meta = {}
+
+    if not body_md.strip():
+        return md.Meta
+
+    lines = six.text_type(body_md).split('\n')
+
+    for name, prep in md.preprocessors.items():
+        lines = prep.run(lines)
+
+        if name == 'meta':
+            break
+
+    return md.Meta
+
+
+def normalize_metadata(metadata):
+    """Given a metadata dictionary produced by the "meta" preprocessor, mapping
+    each variable to a list of values, return a dictionary in which variables
+    with only one value map to that value, as it is put in scope for drafts.
+    """
+    # in Python 2, the variable names and value(s) are unicode(), since they
+    # come from Python-Markdown that way; we will use str() convert them to
+    # regular strings and accept the fact that non-ASCII characters in them
+    # will produce an issue (in Python 3 this does nothing)
+    new_metadata = {}
+    for var, val in metadata.items():
+        if len(val) == 1:
+            # e.g., foo: bar (only one value for the variable "foo")
+            new_metadata.update({str(var): str(val[0])})
+        else:
+            new_metadata.update({str(var): [str(s) for s in val]})
+
+    return new_metadata
+
+
+class _MetaHolder(object):
+    """Stands in for the markdown.Markdown object that the "meta" preprocessor
+    stores the metadata in.
+    """
+
+    def __init__(self):
+        self.Meta = {}
+
+
+def read_metadata(text):
+    """Given the contents of a draft, return its metadata dictionary, as
+    produced by the "meta" preprocessor, without needing a markdown.Markdown
+    object.
+    """
+    from markdown.extensions.meta import MetaPreprocessor
+
+    if isinstance(text, six.binary_type):
+        text = text.decode('utf-8')
+
+    holder = _MetaHolder()
+    MetaPreprocessor(holder).run(text.split('\n'))
+    return holder.Meta
+
+
+def parse_metadata(text):
+    """Like read_metadata(), but return the dictionary given by
+    normalize_metadata().
+    """
+    return normalize_metadata(read_metadata(text))
+
+
 def get_functions(mod):
+    """Given a module, return a dictionary of its public functions by name.
+    Private helpers (whose names begin with "_") are left out, so that pages
+    cannot call them instead of the functions that record dependencies.
+    """
     import inspect
 
     funcs = {}
     for name, member in inspect.getmembers(mod):
-        if inspect.isfunction(member):
+        if inspect.isfunction(member) and not name.startswith('_'):
             funcs[name] = member
 
     return funcs
@@ -0,0 +1,190 @@
+"""This module records the inputs that a page reads while it is converted, other
+than its own Markdown file: the template file, partials and drafts read by the
+functions in presto.functions, and the variables in the [variables] section of
+presto.ini, options in the [presto] section that change every page (such as
+"minify"), and the results of queries of the metadata index (see
+presto.pageindex). Each input is identified by a key such as "template",
+"partial:nav.html", "draft:foo.markdown", "var:footer" or "config:minify" (or
+"vars", for which variables are defined), and is recorded with a digest of its
+current value. A page only needs to be rebuilt if its own Markdown file or the
+digest of one of its inputs has changed.
+"""
+from __future__ import with_statement
+
+import io
+import os
+import hashlib
+import threading
+
+import six
+
+import presto.config as config
+
+
+# the inputs of the page being converted by each thread are recorded
+# separately, as the "recording" attribute (a dict of key -> digest)
+_local = threading.local()
+
+_digests = {}                       # memoized results of current_digest()
+
+
+def start():
+    """Start recording the inputs of a page."""
+    _local.recording = {}
+
+
+def stop():
+    """Stop recording the inputs of a page and return the recorded inputs as
+    a dictionary mapping keys to digests.
+    """
+    recorded, _local.recording = _recording(), None
+    return recorded
+
+
+def _recording():
+    return getattr(_local, 'recording', None)
+
+
+def is_recording():
+    return _recording() is not None
+
+
+def record(key, digest):
+    recording = _recording()
+    if recording is not None:
+        recording[key] = digest
+
+
+def record_file(kind, name, digest):
+    """Record a dependency on a file with the specified digest (see
+    file_digest()), which was found by looking up the specified name in a
+    directory given by presto.ini.
+    """
+    record('{}:{}'.format(kind, name), digest)
+
+
+def record_variable(name, value):
+    """Record a dependency on a variable in the [variables] section of
+    presto.ini, which has the specified value, or is not defined if the value
+    is None.
+    """
+    if _recording() is not None:
+        record('var:' + name, None if value is None else text_digest(value))
+
+
+def record_variable_names(names):
+    """Record a dependency on which variables are defined in the [variables]
+    section of presto.ini, given their names.
+    """
+    if _recording() is not None:
+        record('vars', _names_digest(names))
+
+
+def record_config(name):
+    """Record a dependency on an option in the [presto] section of presto.ini
+    that changes the HTML of every page.
+    """
+    if _recording() is not None:
+        record('config:' + name, text_digest(config.get(name) or ''))
+
+
+def get_stat_key(path):
+    """Return a (mtime in nanoseconds, size, inode number) tuple for the
+    specified file. If this tuple has not changed since the file was last
+    hashed, the file is assumed to be unchanged.
+    """
+    st = os.stat(path)
+
+    # st_mtime_ns is not available in Python 2
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1000000000)
+
+    return (mtime_ns, st.st_size, st.st_ino)
+
+
+def file_digest(path):
+    with io.open(path, mode='rb') as f:
+        return data_digest(f.read())
+
+
+def data_digest(data):
+    return hashlib.md5(data).hexdigest()
+
+
+def text_digest(s):
+    if isinstance(s, six.text_type):
+        s = s.encode('utf-8')
+
+    return data_digest(s)
+
+
+def _names_digest(names):
+    return text_digest('\n'.join(sorted(names)))
+
+
+def clear():
+    """Forget the memoized digests of all inputs, so that changes made to them
+    since they were last computed will be seen.
+    """
+    _digests.clear()
+
+
+def current_digest(key):
+    """Return the digest that the input identified by the specified key has
+    now, or None if the input no longer exists.
+    """
+    try:
+        return _digests[key]
+    except KeyError:
+        # another thread may clear() the memo at any time, so return the
+        # digest computed here rather than looking it up again
+        digest = _digests[key] = _compute_digest(key)
+        return digest
+
+
+def _compute_digest(key):
+    kind, _, name = key.partition(':')
+
+    if kind == 'var':
+        value = config.get_variables().get(name)
+        return None if value is None else text_digest(value)
+
+    if kind == 'vars':
+        return _names_digest(config.get_variables())
+
+    if kind == 'config':
+        return text_digest(config.get(name) or '')
+
+    if kind == 'pages':
+        import presto.pageindex as pageindex
+        return pageindex.query_digest(name)
+
+    if kind == 'template':
+        path = config.get_filepath('template_file')
+    elif kind == 'partial':
+        path = os.path.join(config.get_filepath('partials_dir'), name)
+    elif kind == 'draft':
+        path = os.path.join(config.get_filepath('markdown_dir'), name)
+    else:
+        return None
+
+    try:
+        return file_digest(path)
+    except (IOError, OSError):
+        return None
+
+
+def unchanged(recorded):
+    """Given a dictionary of inputs recorded for a page, return True if none of
+    the inputs have changed since they were recorded. If nothing was recorded
+    for the page (None, as opposed to an empty dictionary), return False.
+    """
+    if recorded is None:
+        return False
+
+    for key, digest in recorded.items():
+        if current_digest(key) != digest:
+            return False
+
+    return True
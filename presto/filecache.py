@@ -0,0 +1,97 @@
+"""This module provides the cache of files read by the partial() and draft()
+functions in presto.functions, so that a partial included by every page is read
+from disk once per process instead of once per page. A cached file is used as
+long as its stat key (see deps.get_stat_key()) has not changed. The cache
+holds files totalling at most _MAX_BYTES bytes, and discards the least
+recently used files when it is full.
+"""
+from __future__ import with_statement
+
+import io
+import threading
+import collections
+
+import six
+
+import presto.deps as deps
+
+
+_MAX_BYTES = 16 * 1024 * 1024
+
+_entries = collections.OrderedDict()    # path -> Entry, least recent first
+_size = 0                               # total size of cached files
+_lock = threading.Lock()
+
+
+class Entry(object):
+    """The contents of a cached file, its digest (see deps.file_digest()),
+    its size in bytes, and a dictionary in which callers can keep values
+    computed from the contents, which are discarded along with the entry when
+    the file changes.
+    """
+
+    def __init__(self, stat_key, text, digest, size):
+        self.stat_key = stat_key
+        self.text = text
+        self.digest = digest
+        self.size = size
+        self.derived = {}
+
+
+def _decode(data):
+    # decode the file like open(path, 'r') would have read it: in Python 2,
+    # as a byte string; otherwise, using the preferred encoding and with
+    # universal newlines
+    if six.PY2:
+        return data
+
+    return io.TextIOWrapper(io.BytesIO(data)).read()
+
+
+def get(path):
+    """Return an Entry for the file at the specified path, reading the file
+    only if it is not cached or has changed since it was cached.
+    """
+    global _size
+
+    stat_key = deps.get_stat_key(path)
+
+    with _lock:
+        entry = _entries.pop(path, None)
+
+        if entry is not None:
+            if entry.stat_key == stat_key:
+                # move the file to the most recently used end
+                _entries[path] = entry
+                return entry
+
+            _size -= entry.size
+
+    # the file is read once, so that its text and digest are of the same
+    # version of the file
+    with io.open(path, mode='rb') as f:
+        data = f.read()
+
+    entry = Entry(stat_key, _decode(data), deps.data_digest(data), len(data))
+
+    with _lock:
+        old = _entries.pop(path, None)
+        if old is not None:
+            _size -= old.size
+
+        _entries[path] = entry
+        _size += entry.size
+
+        while _size > _MAX_BYTES and len(_entries) > 1:
+            _, evicted = _entries.popitem(last=False)
+            _size -= evicted.size
+
+    return entry
+
+
+def clear():
+    global _size
+
+    with _lock:
+        _entries.clear()
+        _size = 0
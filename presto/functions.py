@@ -9,6 +9,8 @@ import os
 import six
 
 import presto.config as config
+import presto.deps as deps
+import presto.filecache as filecache
 
 
 def _get_path(config_name, path):
@@ -23,23 +25,79 @@ def _get_path(config_name, path):
     return os.path.join(prefix, path)
 
 
+def _read_file(config_name, kind, path):
+    """Given the name of a directory in presto.ini, the kind of file in it
+    (see presto.deps) and a path relative to the directory, return the cached
+    presto.filecache.Entry for the file, and record the page's dependency on it.
+    """
+    entry = filecache.get(_get_path(config_name, path))
+    deps.record_file(kind, path, entry.digest)
+    return entry
+
+
+def _draft_body(entry):
+    if 'body' not in entry.derived:
+        content = entry.text.strip().split('\n')
+
+        for i, line in enumerate(content):
+            if line == '':
+                break
+
+        rest = content[i + 1:]
+        entry.derived['body'] = '\n'.join(rest)
+
+    return entry.derived['body']
+
+
 def draft(path):
-    with open(_get_path('markdown_dir', path), 'r') as f:
-        content = f.read().strip()
+    return _draft_body(_read_file('markdown_dir', 'draft', path))
 
-    content = content.split('\n')
 
-    for i, line in enumerate(content):
-        if line == '':
-            break
+def draft_with_metadata(path):
+    """Given the path of a draft, return a (body, metadata) tuple, where body
+    is what draft() returns, and metadata is a dictionary of the variables in
+    the draft's metadata header, as they would be in scope for the draft.
+    """
+    import presto.convert as convert
+
+    entry = _read_file('markdown_dir', 'draft', path)
+
+    if 'metadata' not in entry.derived:
+        entry.derived['metadata'] = convert.parse_metadata(entry.text.strip())
+
+    # the cached values must not be changed by the caller
+    metadata = {var: list(val) if isinstance(val, list) else val
+                for var, val in entry.derived['metadata'].items()}
 
-    rest = content[i + 1:]
-    return '\n'.join(rest)
+    return _draft_body(entry), metadata
 
 
 def partial(path):
-    with open(_get_path('partials_dir', path), 'r') as f:
-        return f.read().strip()
+    return _read_file('partials_dir', 'partial', path).text.strip()
+
+
+def pages(sort=None, reverse=False, limit=None, where=None, unpublished=False,
+          **metadata):
+    """Return a list of dictionaries describing the drafts in the Markdown
+    directory, each with the keys "relpath" (its path relative to the Markdown
+    directory), "url" (the path of its output file, or None if it is not
+    published), "hash" and "metadata" (its metadata header). Only published
+    drafts are included, unless unpublished is True. Each keyword argument
+    selects the drafts whose metadata variable of that name has the given
+    value (or is a list containing it), and where, if given, is a function
+    that selects the drafts for which it returns True. The drafts are sorted
+    by relative path, or by sort, which is the name of a metadata variable,
+    "relpath", "url", or a function returning the key to sort a draft by.
+    At most limit drafts are returned, if it is given.
+    """
+    import presto.pageindex as pageindex
+
+    key = pageindex.query_key(sort, reverse, limit, where, unpublished, metadata)
+
+    if deps.is_recording():
+        deps.record(key, deps.current_digest(key))
+
+    return pageindex.query(sort, reverse, limit, where, unpublished, metadata)
 
 
 def shell(func, args=None, kwargs=None, prompt='>>> ', followup=True):
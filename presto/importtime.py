@@ -0,0 +1,78 @@
+"""This module measures how long each module imported by Presto takes to import,
+for the --debug option. Once install() is called, every import statement that
+loads at least one new module is timed, and report() prints the slowest ones,
+with the time spent importing each module by itself (not counting the modules
+it imports) and including the modules it imports.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import threading
+
+# six is not used here, so that the time taken to import it is measured
+try:
+    import builtins
+except ImportError:
+    # Python 2
+    import __builtin__ as builtins
+
+
+_TOP_N = 15                         # number of slowest imports to print
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+_original_import = None
+# time spent in nested imports by each thread, per level, as the "stack"
+# attribute
+_nested = threading.local()
+_imports = []                       # (name, self time, cumulative time)
+
+
+def _timed_import(name, *args, **kwargs):
+    num_modules = len(sys.modules)
+
+    stack = getattr(_nested, 'stack', None)
+    if stack is None:
+        stack = _nested.stack = []
+
+    stack.append(0.0)
+    start = _clock()
+
+    try:
+        return _original_import(name, *args, **kwargs)
+    finally:
+        elapsed = _clock() - start
+        nested = stack.pop()
+
+        if stack:
+            stack[-1] += elapsed
+
+        if len(sys.modules) > num_modules:
+            if not name:
+                # e.g., "from . import foo"
+                fromlist = args[2] if len(args) > 2 else kwargs.get('fromlist')
+                name = '.' + ', .'.join(fromlist or [])
+
+            _imports.append((name, elapsed - nested, elapsed))
+
+
+def install():
+    global _original_import
+
+    if _original_import is None:
+        _original_import = builtins.__import__
+        builtins.__import__ = _timed_import
+
+
+def report():
+    """Print the imports that took the longest, to standard error."""
+    total = sum(self_time for _, self_time, _ in _imports)
+
+    print('import time: {:.1f} ms in total'.format(total * 1000), file=sys.stderr)
+    print('{:>10} {:>10}  {}'.format('self (ms)', 'total (ms)', 'module'), file=sys.stderr)
+
+    slowest = sorted(_imports, key=lambda i: i[2], reverse=True)
+    for name, self_time, cumulative in slowest[:_TOP_N]:
+        print('{:10.1f} {:10.1f}  {}'.format(self_time * 1000, cumulative * 1000, name),
+              file=sys.stderr)
@@ -0,0 +1,247 @@
+"""This module provides the HTML minifier used when the "minify" option is set in
+presto.ini. It makes one pass over the HTML of a page, from beginning to end,
+and produces the minified HTML in chunks as it goes. It
+
+* collapses each run of whitespace in text to a single character, and removes
+  whitespace between two block-level tags altogether;
+* removes closing tags that HTML allows to be left out, such as </li> before
+  another <li> and </p> before a heading (only looking at the next tag); and
+* removes the quotes around attribute values that do not need them.
+
+The contents of <pre>, <code>, <textarea>, <script> and <style> elements and of
+MathJax spans (<span class="mathjax">) are left exactly as they are.
+"""
+import re
+
+import presto.config as config
+
+
+_TOKEN_PATTERN = re.compile(
+    r'(<!--.*?-->)'                                             # comment
+    r'|(<[!?][^>]*>)'                                           # doctype, etc.
+    r'|<(/?)([A-Za-z][^\s/>]*)((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>'  # tag
+    r'|([^<]+)'                                                 # text
+    r'|(<)',                                                    # stray '<'
+    re.DOTALL
+)
+
+_ATTR_PATTERN = re.compile(
+    r'[ \t\n\r\f]*([^\s"\'>/=]+)(?:[ \t\n\r\f]*=[ \t\n\r\f]*'
+    r'("[^"]*"|\'[^\']*\'|[^\s"\'=<>`]+))?'
+)
+_UNQUOTED_PATTERN = re.compile(r'^[^\s"\'=<>`]+$')
+_WHITESPACE_PATTERN = re.compile(r'[ \t\n\r\f]+')
+_MATHJAX_PATTERN = re.compile(r'\bclass[ \t\n\r\f]*=[ \t\n\r\f]*["\']?[^"\'>]*\bmathjax\b')
+
+# elements whose contents are text that may contain '<', and the patterns
+# matching their closing tags
+_RAW_TEXT = {
+    name: re.compile(r'</' + name + r'[ \t\n\r\f]*>', re.IGNORECASE)
+    for name in ['script', 'style', 'textarea']
+}
+
+# elements whose contents are left as they are, other than the above
+_PRESERVED = set(['pre', 'code'])
+
+# elements between which whitespace is not displayed
+_BLOCK = set([
+    'address', 'article', 'aside', 'base', 'blockquote', 'body', 'caption',
+    'col', 'colgroup', 'dd', 'details', 'dialog', 'div', 'dl', 'dt',
+    'fieldset', 'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3',
+    'h4', 'h5', 'h6', 'head', 'header', 'hgroup', 'hr', 'html', 'li', 'link',
+    'main', 'meta', 'nav', 'ol', 'p', 'pre', 'script', 'section', 'style',
+    'summary', 'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'title', 'tr',
+    'ul'
+])
+
+_P_CLOSERS = set([
+    'address', 'article', 'aside', 'blockquote', 'details', 'div', 'dl',
+    'fieldset', 'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3',
+    'h4', 'h5', 'h6', 'header', 'hgroup', 'hr', 'main', 'menu', 'nav', 'ol',
+    'p', 'pre', 'section', 'table', 'ul'
+])
+
+# optional closing tag -> the tags (closing tags starting with '/') that may
+# follow it when it is left out
+_OPTIONAL_END = {
+    'li': set(['li', '/ul', '/ol', '/menu']),
+    'dt': set(['dt', 'dd']),
+    'dd': set(['dt', 'dd', '/dl']),
+    'tr': set(['tr', '/tbody', '/thead', '/tfoot', '/table']),
+    'td': set(['td', 'th', '/tr']),
+    'th': set(['td', 'th', '/tr']),
+    'thead': set(['tbody', 'tfoot']),
+    'tbody': set(['tbody', 'tfoot', '/table']),
+    'option': set(['option', 'optgroup', '/select', '/datalist', '/optgroup']),
+    # the closing tag of the parent element also closes the paragraph, but
+    # only block-level parents are allowed here, since an inline parent's
+    # closing tag would be ignored instead
+    'p': _P_CLOSERS | set('/' + name for name in _BLOCK)
+}
+
+# elements that have no closing tag, whose start tags need no '/'
+_VOID = set([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+    'param', 'source', 'track', 'wbr'
+])
+
+
+def is_enabled():
+    return (config.get('minify') or '').strip().lower() in ['1', 'yes', 'true', 'on']
+
+
+def _collapse(match):
+    return '\n' if '\n' in match.group(0) else ' '
+
+
+def _minify_tag(name, attrs):
+    """Given the name of a start tag and the text between its name and its
+    closing '>', return the tag with its attributes separated by single spaces
+    and the quotes removed from values that do not need them. If the
+    attributes cannot be parsed, return None.
+    """
+    parts = ['<', name]
+    pos = 0
+    self_closing = False
+
+    while True:
+        m = _ATTR_PATTERN.match(attrs, pos)
+        if m is None:
+            break
+
+        attr, value = m.group(1), m.group(2)
+
+        if value is None:
+            parts.append(' ' + attr)
+        else:
+            if value[0] in '"\'' and _UNQUOTED_PATTERN.match(value[1:-1]):
+                value = value[1:-1]
+
+            parts.append(' {}={}'.format(attr, value))
+
+        pos = m.end()
+
+    rest = attrs[pos:].strip()
+
+    if rest == '/':
+        self_closing = True
+    elif rest:
+        return None
+
+    if self_closing and name.lower() not in _VOID:
+        # the space keeps the slash from being read as part of an unquoted
+        # value
+        parts.append(' /')
+
+    parts.append('>')
+    return ''.join(parts)
+
+
+def iter_minify(html):
+    """Given a string containing HTML, minify it in one pass and generate the
+    minified HTML as a sequence of strings.
+    """
+    pos = 0
+    end = len(html)
+
+    last = None                     # name of the last tag seen, None at the
+                                    # beginning of the document
+    pending_end = None              # (name, text) of an optional closing tag
+    pending_space = None            # whitespace between two tags
+
+    # name of the element whose contents are being left as they are, and the
+    # number of those elements that are open
+    preserved = None
+    depth = 0
+
+    while pos < end:
+        m = _TOKEN_PATTERN.match(html, pos)
+        pos = m.end()
+
+        comment, other, slash, name, attrs, text, stray = m.groups()
+
+        if preserved is not None:
+            if name is not None and name.lower() == preserved:
+                depth += -1 if slash else 1
+
+                if depth == 0:
+                    preserved = None
+                    last = name.lower()
+
+            yield m.group(0)
+            continue
+
+        if name is None:
+            if text is not None and not text.strip(' \t\n\r\f'):
+                pending_space = text
+                continue
+
+            # a comment or some text: every pending tag and space is needed
+            if pending_end is not None:
+                yield pending_end[1]
+                pending_end = None
+
+            if pending_space is not None:
+                yield _WHITESPACE_PATTERN.sub(_collapse, pending_space)
+                pending_space = None
+
+            if text is not None:
+                yield _WHITESPACE_PATTERN.sub(_collapse, text)
+                last = '#text'
+            else:
+                yield comment or other or stray
+                last = None if other is not None else '#comment'
+
+            continue
+
+        lower = name.lower()
+        key = '/' + lower if slash else lower
+
+        if pending_end is not None:
+            if key not in _OPTIONAL_END[pending_end[0]]:
+                yield pending_end[1]
+
+            pending_end = None
+
+        if pending_space is not None:
+            # the beginning of the document counts as block-level
+            if not ((last is None or last in _BLOCK) and lower in _BLOCK):
+                yield _WHITESPACE_PATTERN.sub(_collapse, pending_space)
+
+            pending_space = None
+
+        last = lower
+
+        if slash:
+            if lower in _OPTIONAL_END:
+                pending_end = (lower, '</{}>'.format(name))
+            else:
+                yield '</{}>'.format(name)
+
+            continue
+
+        if lower in _RAW_TEXT:
+            close = _RAW_TEXT[lower].search(html, pos)
+            stop = end if close is None else close.end()
+
+            yield _minify_tag(name, attrs) or m.group(0)
+            yield html[pos:stop]
+            pos = stop
+        elif lower in _PRESERVED or (lower == 'span' and _MATHJAX_PATTERN.search(attrs)):
+            preserved = lower
+            depth = 1
+
+            yield m.group(0)
+        else:
+            yield _minify_tag(name, attrs) or m.group(0)
+
+    if pending_end is not None:
+        yield pending_end[1]
+
+    if pending_space is not None and last is not None and last not in _BLOCK:
+        yield _WHITESPACE_PATTERN.sub(_collapse, pending_space)
+
+
+def minify(html):
+    """Given a string containing HTML, return the minified HTML."""
+    return ''.join(iter_minify(html))
@@ -2,10 +2,40 @@ import sys
 import argparse
 
 
+def _shard(s):
+    """Parse the argument of the --shard option, "I/N", into an (I, N) tuple."""
+    try:
+        i, n = [int(t) for t in s.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected I/N, e.g., 1/4')
+
+    if not 1 <= i <= n:
+        raise argparse.ArgumentTypeError('I must be between 1 and N')
+
+    return i, n
+
+
 _parser = argparse.ArgumentParser(
     prog='presto',
     description='Static website publisher that generates HTML from Markdown'
 )
+_parser.add_argument(
+    'command',
+    nargs='?',
+    default='publish',
+    choices=['publish', 'plan', 'serve', 'merge-manifests'],
+    help='"publish" (the default) publishes the drafts that have changed; '
+         '"plan" lists the files that publishing would rebuild (longest first, '
+         'with the seconds each took last time), skip or remove; '
+         '"serve" starts an HTTP server that converts drafts when they are requested; '
+         '"merge-manifests" cleans up the output directory of a sharded build'
+)
+_parser.add_argument(
+    'manifests',
+    nargs='*',
+    metavar='MANIFEST',
+    help='manifests written by every shard of a build (for "merge-manifests")'
+)
 _parser.add_argument(
     '-c', '--config',
     default='presto.ini',
@@ -16,6 +46,14 @@ _parser.add_argument(
     action='store_true',
     help='use empty string for {-sequences that produce errors'
 )
+_parser.add_argument(
+    '--reporter',
+    choices=['human', 'json', 'quiet'],
+    default='human',
+    help='how to report what happens: "human" (the default) prints a line for '
+         'each file, "json" prints a JSON object per line for each file and the '
+         'totals, and "quiet" prints only errors and the totals'
+)
 _parser.add_argument(
     '--hide-skipped',
     action='store_true',
@@ -26,6 +64,81 @@ _parser.add_argument(
     action='store_true',
     help='do not actually change any files, just show what would be done'
 )
+_parser.add_argument(
+    '--only',
+    nargs='+',
+    metavar='RELPATH',
+    help='publish only the files with these paths, relative to the Markdown '
+         'directory, without cleaning up the output directory'
+)
+_parser.add_argument(
+    '--paranoid',
+    action='store_true',
+    help='always hash Markdown files, even if their size and modification time have not changed'
+)
+_concurrency = _parser.add_mutually_exclusive_group()
+_concurrency.add_argument(
+    '-j', '--jobs',
+    type=int,
+    default=1,
+    metavar='N',
+    help='convert files using N worker processes (default is 1)'
+)
+_concurrency.add_argument(
+    '--threads',
+    type=int,
+    default=1,
+    metavar='N',
+    help='convert files using N threads in this process, which start much '
+         'faster than worker processes but share one interpreter (default is 1)'
+)
+_parser.add_argument(
+    '--gzip',
+    action='store_true',
+    help='keep a copy of each HTML file compressed with gzip next to it, '
+         'as if gzip were set in presto.ini (see also gzip_level and '
+         'gzip_min_size in presto.ini)'
+)
+_parser.add_argument(
+    '--shard',
+    type=_shard,
+    metavar='I/N',
+    help='split the drafts into N shards and publish only shard I (from 1 to N), '
+         'without cleaning up the output directory, and write a manifest of the '
+         'shard\'s output files (see --manifest and "merge-manifests")'
+)
+_parser.add_argument(
+    '--manifest',
+    metavar='PATH',
+    help='path of the manifest written by --shard (default is the path of the '
+         'cache file with ".shard-I-of-N.json" appended)'
+)
+_parser.add_argument(
+    '--profile',
+    nargs='?',
+    const='',
+    metavar='REPORT',
+    help='time each stage of publishing each page, print the slowest pages and '
+         'the time per stage, and write all timings as JSON to REPORT, if given '
+         '(use --profile=REPORT)'
+)
+_parser.add_argument(
+    '-w', '--watch',
+    action='store_true',
+    help='keep running, and publish again whenever a file changes'
+)
+_parser.add_argument(
+    '--bind',
+    default='127.0.0.1',
+    metavar='ADDRESS',
+    help='address the "serve" command listens on (default is 127.0.0.1)'
+)
+_parser.add_argument(
+    '--port',
+    type=int,
+    default=8000,
+    help='port the "serve" command listens on (default is 8000)'
+)
 _parser.add_argument(
     '--debug',
     action='store_true',
@@ -34,6 +147,13 @@ _parser.add_argument(
 
 _args = vars(_parser.parse_args())
 
+# only "merge-manifests" takes more positional arguments
+if _args['command'] == 'merge-manifests':
+    if not _args['manifests']:
+        _parser.error('"merge-manifests" needs the manifests of every shard')
+elif _args['manifests']:
+    _parser.error('unrecognized arguments: ' + ' '.join(_args['manifests']))
+
 
 def get(name):
     return _args.get(name, None)
@@ -1,24 +1,358 @@
+"""This module reports what happens during a run, using one of these reporters,
+chosen by the --reporter option:
+
+    human   a colored line for each file published, skipped or removed, which
+            are written to standard output many lines at a time
+    json    a JSON object on its own line for each file published, skipped or
+            removed and for each error, and one for the totals at the end
+    quiet   nothing but errors and the totals
+
+The "plan" command (see presto.plan) is reported the same way, with a line
+(or object) for each file that would be rebuilt, skipped or removed, and so
+are the timings printed by the --profile option and the status messages of
+the "serve" command and the --watch option.
+
+Tracebacks (see the --debug option) are always written to standard error.
+"""
 from __future__ import print_function
 
 import sys
+import json
+import time
+import atexit
+import threading
+
+import six
+
+import presto.options as options
+
+
+_FLUSH_LINES = 1000                 # most lines the human reporter buffers
+_FLUSH_INTERVAL = 0.25              # longest time (in seconds) it buffers them
+
+# {-sequences taking less time than this (in seconds) are not worth listing
+# after the totals
+_SLOW_SEQUENCE = 0.1
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+_COLORS = {
+    'error': '\033[31merror:\033[0m',
+    'published': '\033[32m[published]\033[0m',
+    'identical': '\033[34m[identical]\033[0m',
+    'removed': '\033[35m[removed]\033[0m',
+    'skipped': '\033[36m[skipped]\033[0m'
+}
+
+
+def _encode(s):
+    # in Python 2, lines may be a mix of byte strings and Unicode strings,
+    # which are written as UTF-8, like print() would
+    if six.PY2 and isinstance(s, six.text_type):
+        return s.encode('utf-8')
+
+    return s
+
+
+class HumanReporter(object):
+    """Prints a colored line for each event, buffering the lines so that they
+    are written with few system calls, but never holding a line back for
+    longer than _FLUSH_INTERVAL: a timer writes the buffered lines if no other
+    line does first (such as while a slow page is being converted). Errors
+    are written to standard error at once, after the lines before them.
+    """
+
+    # whether the stages of publishing each page should be timed (see
+    # presto.profiler)
+    wants_timings = False
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lines = []
+        self.last_flush = _clock()
+        self.timer = None           # threading.Timer that will call flush()
+
+    def write(self, line):
+        line = _encode(line + '\n')
+
+        with self.lock:
+            self.lines.append(line)
+
+            if (len(self.lines) >= _FLUSH_LINES or
+                    _clock() - self.last_flush >= _FLUSH_INTERVAL):
+                self._flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(_FLUSH_INTERVAL, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        if self.lines:
+            sys.stdout.write(''.join(self.lines))
+            self.lines = []
+
+        sys.stdout.flush()
+        self.last_flush = _clock()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def write_error(self, text):
+        text = _encode(text)
+
+        with self.lock:
+            self._flush()
+            sys.stderr.write(text)
+            sys.stderr.flush()
+
+    def event(self, kind, msg):
+        self.write(_COLORS[kind] + ' ' + msg)
+
+    def removed_directory(self, path):
+        self.event('removed', 'empty directory ' + path)
+
+    def error(self, msg):
+        self.write_error(_COLORS['error'] + ' ' + msg + '\n')
+
+    def result(self, result):
+        for kind, msg in result.events:
+            if kind == 'error':
+                self.error(msg)
+            elif kind == 'traceback':
+                self.write_error(msg)
+            elif kind in _COLORS:
+                self.event(kind, msg)
+            else:
+                self.write(msg)
+
+    def planned(self, action, seconds, relpath):
+        # plain columns, which are easy to pass to other programs
+        cost = '-' if seconds is None else '{:.3f}'.format(seconds)
+        self.write('{:<8}{:>10}  {}'.format(action, cost, relpath))
+
+    def status(self, msg):
+        self.write(msg)
+        self.flush()
+
+    def profile(self, slowest, totals):
+        self.write('')
+        self.write('slowest pages:')
+        self.write('{:>10} {:>10}  {}'.format('wall (s)', 'cpu (s)', 'page'))
+        for relpath, (wall, cpu) in slowest:
+            self.write('{:10.3f} {:10.3f}  {}'.format(wall, cpu, relpath))
+
+        self.write('')
+        self.write('time per stage:')
+        self.write('{:>10} {:>10}  {}'.format('wall (s)', 'cpu (s)', 'stage'))
+        for stage, (wall, cpu) in totals:
+            self.write('{:10.3f} {:10.3f}  {}'.format(wall, cpu, stage))
+
+        self.flush()
+
+    def summary(self, summary):
+        self.write(str(summary))
+
+        slowest = [s for s in getattr(summary, 'slowest', [])
+                   if s[0] >= _SLOW_SEQUENCE]
+        if slowest:
+            self.write('slowest {-sequences:')
+            for seconds, relpath, location in slowest:
+                self.write('{:10.3f} s  {}, {}'.format(seconds, relpath, location))
+
+        self.flush()
+
+
+class QuietReporter(HumanReporter):
+    """Prints only errors and the totals."""
+
+    def summary(self, summary):
+        self.write(str(summary))
+        self.flush()
+
+    def event(self, kind, msg):
+        pass
+
+    def planned(self, action, seconds, relpath):
+        pass
+
+    def status(self, msg):
+        pass
+
+    def result(self, result):
+        for kind, msg in result.events:
+            if kind == 'error':
+                self.error(msg)
+            elif kind == 'traceback':
+                self.write_error(msg)
+
+
+class JSONReporter(HumanReporter):
+    """Prints a JSON object on its own line for each event. The object for a
+    file has the keys "event" (such as "published", "identical", "skipped" or
+    "failed"), "relpath", "duration" (in seconds), "timings" (the wall-clock
+    and CPU time of each stage, see presto.profiler), "bytes" (the size of the
+    output file written), "errors" and "messages".
+    """
+
+    wants_timings = True
+
+    def emit(self, obj):
+        self.write(json.dumps(obj, sort_keys=True))
+
+    def event(self, kind, msg):
+        self.emit({'event': kind, 'relpath': msg})
+
+    def removed_directory(self, path):
+        self.emit({'event': 'removed', 'directory': path})
+
+    def planned(self, action, seconds, relpath):
+        self.emit({'event': 'plan', 'action': action, 'seconds': seconds,
+                   'relpath': relpath})
+
+    def status(self, msg):
+        self.emit({'event': 'status', 'message': msg})
+        self.flush()
+
+    def profile(self, slowest, totals):
+        self.emit({
+            'event': 'profile',
+            'slowest': [{'relpath': relpath, 'wall': wall, 'cpu': cpu}
+                        for relpath, (wall, cpu) in slowest],
+            'stages': [{'stage': stage, 'wall': wall, 'cpu': cpu}
+                       for stage, (wall, cpu) in totals]
+        })
+        self.flush()
+
+    def error(self, msg):
+        self.emit({'event': 'error', 'message': msg})
+
+    def result(self, result):
+        errors = [msg for kind, msg in result.events if kind == 'error']
+
+        for kind, msg in result.events:
+            if kind == 'traceback':
+                self.write_error(msg)
+
+        if result.status == 'unchanged' and not errors:
+            return
+
+        timings = {stage: {'wall': wall, 'cpu': cpu}
+                   for stage, (wall, cpu) in (result.timings or {}).items()}
+
+        self.emit({
+            'event': result.status,
+            'relpath': result.relpath,
+            'duration': result.duration,
+            'timings': timings,
+            'bytes': result.bytes_written,
+            'errors': errors,
+            'messages': [msg for kind, msg in result.events
+                         if kind not in ['error', 'traceback', 'published',
+                                         'identical', 'skipped']]
+        })
+
+    def summary(self, summary):
+        obj = {'event': 'summary'}
+        obj.update(vars(summary))
+
+        if hasattr(summary, 'slowest'):
+            obj['slowest'] = [{'seconds': seconds, 'relpath': relpath, 'location': location}
+                              for seconds, relpath, location in summary.slowest]
+
+        self.emit(obj)
+        self.flush()
+
+
+_REPORTERS = {
+    'human': HumanReporter,
+    'json': JSONReporter,
+    'quiet': QuietReporter
+}
+
+_reporter = None
+_reporter_lock = threading.Lock()
+
+
+def get_reporter():
+    global _reporter
+
+    if _reporter is None:
+        with _reporter_lock:
+            if _reporter is None:
+                _reporter = _REPORTERS[options.get('reporter') or 'human']()
+                atexit.register(_reporter.flush)
+
+    return _reporter
 
 
 def error(msg):
-    print('\033[31merror:\033[0m', msg, file=sys.stderr)
+    get_reporter().error(msg)
 
 
 def published(msg):
-    print('\033[32m[published]\033[0m', msg)
+    get_reporter().event('published', msg)
+
+
+def identical(msg):
+    get_reporter().event('identical', msg)
 
 
 def removed(msg):
-    print('\033[35m[removed]\033[0m', msg)
+    get_reporter().event('removed', msg)
 
 
 def skipped(msg):
-    print('\033[36m[skipped]\033[0m', msg)
+    get_reporter().event('skipped', msg)
+
+
+def removed_directory(path):
+    get_reporter().removed_directory(path)
+
+
+def planned(action, seconds, relpath):
+    """Report what publishing would do with a file (see presto.plan), where
+    action is 'rebuild', 'skip' or 'remove' and seconds is the estimated cost
+    of rebuilding it, or None.
+    """
+    get_reporter().planned(action, seconds, relpath)
+
+
+def status(msg):
+    """Report what a long-running command (such as "serve") is doing."""
+    get_reporter().status(msg)
+
+
+def profile(slowest, totals):
+    """Report the timings recorded by the --profile option (see
+    presto.profiler), given lists of (relpath, (wall, cpu)) tuples for the
+    slowest pages and (stage, (wall, cpu)) tuples for the time per stage.
+    """
+    get_reporter().profile(slowest, totals)
+
+
+def result(result):
+    """Report the outcome of publishing a file, given a publish.Result
+    object.
+    """
+    get_reporter().result(result)
+
+
+def summary(summary):
+    """Report the totals of a run, given a build.Summary object (or a
+    plan.Summary object, for the "plan" command).
+    """
+    get_reporter().summary(summary)
+
+
+def flush():
+    get_reporter().flush()
 
 
 def traceback():
     import traceback
-    traceback.print_exc()
+    get_reporter().write_error(traceback.format_exc())
@@ -0,0 +1,238 @@
+"""This module provides the metadata index, which holds the metadata header of
+every draft in the Markdown directory, so that pages listing other pages can
+use the pages() function in presto.functions instead of reading every other
+draft. The index is kept in the build database (see presto.builddb), and is
+brought up to date while the Markdown directory is walked, by reading only the
+drafts whose stat keys have changed.
+
+A page that calls pages() depends on the result of its query (see
+presto.deps), so it is published again when the query's result changes, such
+as when a page it lists is added or removed or the metadata of one changes,
+but not when only the body of a page it lists changes.
+"""
+from __future__ import with_statement
+
+import os
+import io
+import json
+import hashlib
+
+import presto.config as config
+import presto.convert as convert
+import presto.deps as deps
+
+
+# relative path of each draft -> (stat key, hash, metadata), where metadata is
+# the dictionary produced by the "meta" preprocessor
+_entries = {}
+
+_changed = set()                    # paths added, changed or removed since
+                                    # the index was last saved
+
+
+def load(entries):
+    """Replace the index with the specified dictionary of entries, such as
+    the one returned by get_entries() or by builddb.load_index().
+    """
+    # the entries may be the index itself, passed to a forked worker process
+    entries = dict(entries)
+
+    _entries.clear()
+    _entries.update(entries)
+    _changed.clear()
+
+
+def get_entries():
+    return _entries
+
+
+def take_changed():
+    """Return the set of relative paths whose entries have been added, changed
+    or removed since the last call to this function.
+    """
+    changed = set(_changed)
+    _changed.clear()
+    return changed
+
+
+def update(path, relpath):
+    """Bring the entry for the draft at the specified path up to date, reading
+    the draft only if its stat key has changed. A draft that cannot be read
+    is removed from the index.
+    """
+    try:
+        stat_key = deps.get_stat_key(path)
+
+        entry = _entries.get(relpath)
+        if entry is not None and entry[0] == stat_key:
+            return
+
+        with io.open(path, mode='rb') as f:
+            data = f.read()
+
+        metadata = convert.read_metadata(data.decode('utf-8'))
+        _entries[relpath] = (stat_key, hashlib.md5(data).hexdigest(), metadata)
+    except:
+        _entries.pop(relpath, None)
+
+    _changed.add(relpath)
+
+
+def prune(relpaths):
+    """Remove the entries of drafts whose relative paths are not in the
+    specified set.
+    """
+    for relpath in [relpath for relpath in _entries if relpath not in relpaths]:
+        del _entries[relpath]
+        _changed.add(relpath)
+
+
+def scan():
+    """Walk the Markdown directory and bring the whole index up to date."""
+    import presto.publish as publish
+
+    markdown_dir = config.get_filepath('markdown_dir')
+    found = set()
+
+    for dirpath, dirnames, filenames in os.walk(markdown_dir):
+        for f in filenames:
+            if not publish.is_markdown(f) or f[0] in ['.', '#'] or f[-1] == '~':
+                continue
+
+            path = os.path.join(dirpath, f)
+            relpath = os.path.relpath(path, markdown_dir)
+
+            update(path, relpath)
+            found.add(relpath)
+
+    prune(found)
+
+
+def _url(relpath):
+    import presto.publish as publish
+
+    if not publish.should_publish(relpath):
+        return None
+
+    return '/' + publish.extension_to_html(relpath).replace(os.sep, '/')
+
+
+def _page(relpath, entry):
+    """Return the dictionary describing the draft with the specified relative
+    path and index entry, as returned by pages().
+    """
+    stat_key, hash, metadata = entry
+
+    return {
+        'relpath': relpath,
+        'url': _url(relpath),
+        'hash': hash,
+        'metadata': convert.normalize_metadata(metadata)
+    }
+
+
+def _matches(value, wanted):
+    if isinstance(value, list):
+        return wanted in value
+
+    return value == wanted
+
+
+def _sort_key(sort):
+    if callable(sort):
+        return sort
+
+    def key(page):
+        if sort in ['relpath', 'url']:
+            value = page[sort]
+        else:
+            value = page['metadata'].get(sort)
+
+        # values of different types are not compared with each other, since
+        # Python 3 cannot order them: single values (strings) go first, then
+        # variables with several values (lists), and pages without the
+        # variable go last
+        if value is None:
+            return (2, None)
+        elif isinstance(value, list):
+            return (1, value)
+        else:
+            return (0, value)
+
+    return key
+
+
+def query(sort=None, reverse=False, limit=None, where=None, unpublished=False,
+          filters=None):
+    """Return a list of dictionaries describing the drafts in the index (see
+    functions.pages() for the arguments).
+    """
+    result = []
+
+    # the index may be updated by another thread (see presto.serve)
+    entries = list(_entries.items())
+    entries.sort(key=lambda item: item[0])
+
+    for relpath, entry in entries:
+        page = _page(relpath, entry)
+
+        if page['url'] is None and not unpublished:
+            continue
+
+        if filters and not all(_matches(page['metadata'].get(var), wanted)
+                               for var, wanted in filters.items()):
+            continue
+
+        if where is not None and not where(page):
+            continue
+
+        result.append(page)
+
+    if sort is not None:
+        result.sort(key=_sort_key(sort), reverse=reverse)
+    elif reverse:
+        result.reverse()
+
+    if limit is not None:
+        result = result[:limit]
+
+    return result
+
+
+def query_key(sort=None, reverse=False, limit=None, where=None,
+              unpublished=False, filters=None):
+    """Return the name of the input (see presto.deps) that a page calling
+    pages() with the specified arguments depends on. Queries that can be
+    described as JSON depend on their result; other queries (such as those
+    using functions) depend on the metadata of every draft.
+    """
+    if where is None and not callable(sort):
+        try:
+            return 'pages:' + json.dumps(
+                [sort, reverse, limit, unpublished, filters or {}],
+                sort_keys=True, separators=(',', ':')
+            )
+        except (TypeError, ValueError):
+            pass
+
+    return 'pages:'
+
+
+def _digest(pages):
+    # the hashes of the drafts are left out, since the page does not need to
+    # be published again when only the body of a draft it lists changes
+    s = json.dumps([[page['relpath'], page['url'], page['metadata']] for page in pages],
+                   sort_keys=True)
+
+    return hashlib.md5(s.encode('utf-8')).hexdigest()
+
+
+def query_digest(name):
+    """Return the digest that the result of the query with the specified
+    name (see query_key()) has now.
+    """
+    if name == '':
+        return _digest(query(unpublished=True))
+
+    sort, reverse, limit, unpublished, filters = json.loads(name)
+    return _digest(query(sort, reverse, limit, None, unpublished, filters))
@@ -0,0 +1,153 @@
+"""This module provides the "plan" command, which shows what publishing would do
+without converting anything or changing any files: for each file in the
+Markdown directory, whether it would be rebuilt or skipped, and for each file
+in the output directory, whether it would be removed. Each file to rebuild is
+given an estimated cost, the time it took to publish last time (see
+publish.Result.duration), and the files to rebuild are listed longest first,
+so that the list can be split among several runs using the --only option.
+
+Unlike a dry run (see the --dry-run option), a file is only hashed when its
+stat key has changed (or when the --paranoid option is used), since nothing
+is converted.
+"""
+from __future__ import print_function, with_statement
+
+import presto.output as output
+import presto.config as config
+import presto.options as options
+import presto.publish as publish
+import presto.deps as deps
+import presto.builddb as builddb
+import presto.pageindex as pageindex
+import presto.build as build
+
+
+class Summary(object):
+    """Counts of what publishing would do, printed at the end of a plan."""
+
+    def __init__(self):
+        self.rebuild = 0
+        self.skip = 0
+        self.remove = 0
+        self.errors = 0
+
+        # estimated number of seconds the files to rebuild would take
+        self.seconds = 0.0
+
+    def __str__(self):
+        return ('{} files to rebuild (about {:.3f} s), {} files to skip, '
+                '{} files to remove; {} errors'.format(
+            self.rebuild, self.seconds, self.skip, self.remove, self.errors
+        ))
+
+
+def get_action(task):
+    """Given a (path, relpath, cache entry) tuple for a file found in the
+    Markdown directory (see build.find_files()), return 'rebuild' if
+    publishing would convert or copy the file, or 'skip' if it would not,
+    following the same rules as publish.publish_file().
+    """
+    path, relpath, cached = task
+
+    if not publish.should_publish(path):
+        return 'skip'
+
+    if cached is None:
+        return 'rebuild'
+
+    cached_hash, cached_stat, cached_inputs, _, _ = cached
+
+    if deps.get_stat_key(path) == cached_stat and not options.get('paranoid'):
+        hash = cached_hash
+    else:
+        hash = publish.compute_hash(path)
+
+    if hash == cached_hash and deps.unchanged(cached_inputs):
+        return 'skip'
+
+    return 'rebuild'
+
+
+def estimate_costs(tasks):
+    """Given a list of tasks (see build.find_files()), return a dictionary
+    mapping the relative path of each to the number of seconds publishing it
+    is expected to take. A file without a recorded duration (such as a new
+    file) is expected to take the average of the recorded ones.
+    """
+    known = [task[2][4] for task in tasks
+             if task[2] is not None and task[2][4] is not None]
+    average = sum(known) / len(known) if known else 0.0
+
+    costs = {}
+    for path, relpath, cached in tasks:
+        if cached is not None and cached[4] is not None:
+            costs[relpath] = cached[4]
+        else:
+            costs[relpath] = average
+
+    return costs
+
+
+def plan():
+    """Report what publishing would do, and return a Summary object."""
+    summary = Summary()
+
+    try:
+        cache = builddb.load(config.get_filepath('cache_file'), dry_run=True)
+        pageindex.load(builddb.load_index())
+    except:
+        if options.get('debug'):
+            output.traceback()
+
+        output.error('could not open cache file')
+        summary.errors += 1
+        cache = builddb.Cache()
+
+    deps.clear()
+    tasks, expected_files = build.find_files(cache)
+
+    if options.get('only'):
+        tasks = build.select_tasks(tasks, options.get('only'), summary)
+
+    rebuild = []
+    skip = []
+
+    for task in tasks:
+        try:
+            action = get_action(task)
+        except:
+            if options.get('debug'):
+                output.traceback()
+
+            output.error("unable to read '{}'".format(task[1]))
+            summary.errors += 1
+            continue
+
+        if action == 'rebuild':
+            rebuild.append(task)
+        else:
+            skip.append(task[1])
+
+    costs = estimate_costs(tasks)
+
+    # longest first, so that runs splitting the list finish at about the same
+    # time; ties are broken by relative path to keep the order deterministic
+    rebuild.sort(key=lambda task: (-costs[task[1]], task[1]))
+
+    for path, relpath, cached in rebuild:
+        output.planned('rebuild', costs[relpath], relpath)
+        summary.rebuild += 1
+        summary.seconds += costs[relpath]
+
+    for relpath in skip:
+        if not options.get('hide_skipped'):
+            output.planned('skip', None, relpath)
+        summary.skip += 1
+
+    # with --only, nothing would be removed (see build.build())
+    if not options.get('only'):
+        for relpath in build.find_orphans(expected_files):
+            output.planned('remove', None, relpath)
+            summary.remove += 1
+
+    return summary
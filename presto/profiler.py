@@ -0,0 +1,166 @@
+"""This module provides the build profiler (the --profile option). When it is
+installed, the functions doing each stage of publishing a page are replaced
+by wrappers that record how much wall-clock and CPU time the stage took, so
+that nothing is timed (and nothing costs extra) unless the option is used.
+
+The stages are:
+
+    hash                    computing the hash of the Markdown file
+    metadata                reading the metadata header of the draft
+    body                    evaluating the {-sequences in the draft
+    markdown                converting the draft from Markdown to HTML
+    treeprocessor:<name>    each Markdown tree processor, such as "hilite"
+                            (Pygments) and "inline" (part of "markdown")
+    template                evaluating the template file
+    write                   writing the output file
+
+The time taken by the whole page, including anything not covered by a stage,
+is recorded as "total".
+"""
+from __future__ import print_function, with_statement
+
+import io
+import json
+import time
+import threading
+
+import six
+
+import presto.output as output
+import presto.convert as convert
+import presto.publish as publish
+
+
+_TOP_N = 10                         # number of slowest pages to print
+
+_wall_clock = getattr(time, 'perf_counter', time.time)
+
+# the CPU time of the calling thread is used where it is available (Python
+# 3.7 and later), so that pages published by other threads (see the --threads
+# option) are not counted; time.process_time() is not available in Python 2,
+# where time.clock() is the CPU time of the process on Unix
+_cpu_clock = (getattr(time, 'thread_time', None) or
+              getattr(time, 'process_time', None) or time.clock)
+
+_installed = False
+# dict of stage -> [wall, cpu] for the page being published by each thread,
+# as the "timings" attribute
+_current = threading.local()
+_pages = []                         # (relpath, timings) for each page
+
+
+def _timed(stage, func):
+    """Return a function that calls func and adds the time it takes to the
+    specified stage of the page being published.
+    """
+    def wrapper(*args, **kwargs):
+        wall, cpu = _wall_clock(), _cpu_clock()
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings = getattr(_current, 'timings', None)
+            if timings is not None:
+                timing = timings.setdefault(stage, [0.0, 0.0])
+                timing[0] += _wall_clock() - wall
+                timing[1] += _cpu_clock() - cpu
+
+    return wrapper
+
+
+def _time_page(func):
+    timed = _timed('total', func)
+
+    def wrapper(task):
+        _current.timings = {}
+
+        try:
+            result = timed(task)
+            result.timings = _current.timings
+        finally:
+            _current.timings = None
+
+        return result
+
+    return wrapper
+
+
+def _time_markdown(func):
+    def wrapper():
+        md = func()
+
+        md.convert = _timed('markdown', md.convert)
+        for name, processor in md.treeprocessors.items():
+            processor.run = _timed('treeprocessor:' + name, processor.run)
+
+        return md
+
+    return wrapper
+
+
+def install():
+    """Replace the functions doing each stage of publishing a page with timed
+    wrappers. This must be done before any markdown.Markdown object is created
+    (see publish.convert_file()).
+    """
+    global _installed
+
+    if _installed:
+        return
+
+    _installed = True
+
+    publish.compute_hash = _timed('hash', publish.compute_hash)
+    publish.write_file = _timed('write', publish.write_file)
+    publish.make_markdown = _time_markdown(publish.make_markdown)
+    publish._publish_file = _time_page(publish._publish_file)
+
+    convert.get_metadata = _timed('metadata', convert.get_metadata)
+    convert.eval_brackets = _timed('body', convert.eval_brackets)
+    convert.Template.render = _timed('template', convert.Template.render)
+
+
+def add_page(relpath, timings):
+    if timings:
+        _pages.append((relpath, timings))
+
+
+def report(path=None):
+    """Report the slowest pages and the total time spent in each stage (see
+    output.profile()), and if a path is given, write all of the timings to it
+    as JSON.
+    """
+    totals = {}
+    for relpath, timings in _pages:
+        for stage, (wall, cpu) in timings.items():
+            total = totals.setdefault(stage, [0.0, 0.0])
+            total[0] += wall
+            total[1] += cpu
+
+    slowest = sorted(_pages, key=lambda page: page[1]['total'][0], reverse=True)
+
+    output.profile(
+        [(relpath, tuple(timings['total'])) for relpath, timings in slowest[:_TOP_N]],
+        [(stage, tuple(totals[stage]))
+         for stage in sorted(totals, key=lambda stage: totals[stage][0], reverse=True)]
+    )
+
+    if path:
+        report = {
+            'pages': [
+                {
+                    'relpath': relpath,
+                    'stages': {stage: {'wall': wall, 'cpu': cpu}
+                               for stage, (wall, cpu) in timings.items()}
+                }
+                for relpath, timings in slowest
+            ],
+            'totals': {stage: {'wall': wall, 'cpu': cpu}
+                       for stage, (wall, cpu) in totals.items()}
+        }
+
+        try:
+            with io.open(path, mode='w') as f:
+                f.write(six.text_type(json.dumps(report, indent=2, sort_keys=True)))
+        except:
+            output.error("could not write profile report '{}'".format(path))
@@ -0,0 +1,569 @@
+"""This module provides the work done for each file found under the Markdown
+directory: hashing it, converting it to HTML and writing the output file. The
+same functions are used whether files are published one at a time, by a pool
+of worker processes (see the --jobs option) or by a pool of threads (see the
+--threads option).
+"""
+from __future__ import print_function, with_statement
+
+import sys
+import os
+import io
+import stat
+import time
+import hashlib
+
+import presto.output as output
+import presto.convert as convert
+import presto.config as config
+import presto.options as options
+import presto.deps as deps
+import presto.bytecode as bytecode
+import presto.assets as assets
+import presto.watchdog as watchdog
+
+
+# markdown.Markdown objects not in use by any thread; a Markdown object keeps
+# state while converting, so each page being converted needs its own, and the
+# first one is made when the first page is converted (see make_markdown())
+_idle_md = []
+_template = None                    # convert.Template for the template file
+_template_digest = None             # digest of the template file
+
+_SLOWEST_SEQUENCES = 5              # slowest {-sequences recorded per page
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+class Result(object):
+    """The outcome of handling one file, returned by publish_file(). Since it
+    may be produced in a worker process, it records what should be printed
+    (as a list of (kind, message) pairs) instead of printing it, so that the
+    main process can report results in a deterministic order.
+    """
+
+    def __init__(self, relpath):
+        self.relpath = relpath
+        self.hash = None
+        self.stat = None
+        self.deps = None
+        self.output_digest = None
+        self.duration = None        # seconds taken to publish the file
+        self.bytes_written = 0      # size of the output file, if written
+        self.status = 'unchanged'   # or 'published', 'identical', 'skipped',
+                                    # or 'failed'
+        self.num_errors = 0
+        self.events = []
+
+        # stage -> [wall, cpu] times, if the --profile option is used
+        self.timings = None
+
+        # bytecode cache activity (see presto.bytecode)
+        self.code_hits = self.code_misses = 0
+        self.new_code = ({}, set())     # see bytecode.take_new()
+
+        # (seconds, location) of the slowest {-sequences of the page
+        self.sequence_times = []
+
+    def cache_entry(self):
+        """Return the entry for the file in the build database (see
+        presto.builddb).
+        """
+        return (self.hash, self.stat, self.deps, self.output_digest, self.duration)
+
+    def log(self, kind, msg):
+        self.events.append((kind, msg))
+
+    def error(self, msg):
+        if options.get('debug'):
+            import traceback
+            if sys.exc_info()[0] is not None:
+                self.log('traceback', traceback.format_exc())
+
+        self.log('error', msg)
+        self.num_errors += 1
+
+
+def compute_hash(path):
+    """Open the specified file in binary mode and use its raw bytes to compute
+    and return an MD5 hex digest of the file.
+    """
+    h = hashlib.md5()
+
+    # read the file in chunks, so that large assets (see presto.assets) are
+    # not read into memory all at once
+    with io.open(path, mode='rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def makedirs(dirpath):
+    """Recursively create directories up to the leaf directory, if they
+    do not already exist. Unlike os.makedirs, this function will not
+    produce an error if any intermediate directories exist or have modes
+    not matching the 'mode' parameter. Return a list of the directories
+    that were created.
+    """
+    head, tail = os.path.split(dirpath)
+    if tail == '':
+        # root directory or current relative root has been reached
+        return []
+    else:
+        # make all parent directories
+        created = makedirs(head)
+
+        # make this directory if it does not exist
+        if not os.path.isdir(dirpath):
+            try:
+                os.mkdir(dirpath)
+                created.append(dirpath)
+            except OSError:
+                # another worker process may have just created it
+                if not os.path.isdir(dirpath):
+                    raise
+
+        return created
+
+
+def should_publish(path):
+    filename = os.path.basename(path)
+    return filename[0] != '_'
+
+
+def is_markdown(filename):
+    lower = filename.lower()
+    return lower.endswith('.markdown') or lower.endswith('.md')
+
+
+def extension_to_html(filename):
+    lower = filename.lower()
+    for ext in ['.markdown', '.md']:
+        if lower.endswith(ext):
+            parts = filename.split('.')
+            return '.'.join(parts[:-1]) + config.get('html_extension')
+
+    return filename
+
+
+def extension_drop(filename):
+    config_ext = config.get('html_extension').lower()
+    if '.' in config_ext:
+        config_ext = config_ext.split('.')[-1]
+
+    parts = filename.split('.')
+    ext = parts[-1]
+    if ext.lower() in ['md', 'markdown', config_ext]:
+        return '.'.join(parts[:-1])
+    else:
+        return filename
+
+
+def config_get(name):
+    value = config.get(name)
+    if value is None:
+        output.error('no value for required configuration variable "{}"'.format(name))
+        sys.exit(1)
+    else:
+        return value
+
+
+def config_get_filepath(name):
+    value = config.get_filepath(name)
+    if value is None:
+        output.error('no value for required configuration variable "{}"'.format(name))
+        sys.exit(1)
+    else:
+        return value
+
+
+def get_bytecode_cache_path():
+    """Return the path of the bytecode cache file, which is given by the
+    "bytecode_cache" configuration variable, if it is defined, or else is the
+    path of the cache file with ".bytecode" appended.
+    """
+    path = config.get_filepath('bytecode_cache')
+
+    if path is None:
+        path = config_get_filepath('cache_file') + '.bytecode'
+
+    return path
+
+
+def make_markdown():
+    # Python-Markdown, its extensions and Pygments (used by codehilite) take
+    # much longer to import than everything else, so they are only imported
+    # once a page needs to be converted, and not at all by runs that find
+    # nothing to publish
+    import markdown
+    import mdx_grid_tables as grid_tables
+    import mdx_mathjax as mathjax
+    import mkdcomments as comments
+
+    extensions = [
+        'def_list',
+        'footnotes',
+        'meta',
+        'smarty',
+        'headerid',
+        'tables',
+        'codehilite',
+        'admonition',
+        'toc',
+        grid_tables.GridTableExtension(),
+        mathjax.MathJaxExtension(),
+        comments.CommentsExtension()
+    ]
+
+    args = {
+        'extensions': extensions,
+        'extension_configs': {
+            'smarty': [('smart_ellipses', False)]
+        },
+        'output_format': 'html5',
+        'lazy_ol': False
+    }
+
+    return markdown.Markdown(**args)
+
+
+def set_template(template):
+    """Prepare this process for calling publish_file(), using the specified
+    convert.Template object for every page.
+    """
+    global _template, _template_digest
+
+    _template = template
+    _template_digest = deps.current_digest('template')
+
+
+def init_worker(ini_path, template, index):
+    """Initializer for the processes of a multiprocessing.Pool, given the
+    metadata index of the main process (see presto.pageindex).
+    """
+    import presto.pageindex as pageindex
+
+    if config.get_ini_path() is None:
+        config.load(path=ini_path)
+
+    pageindex.load(index)
+
+    os.umask(0o002)
+
+    if options.get('profile') is not None or output.get_reporter().wants_timings:
+        import presto.profiler as profiler
+        profiler.install()
+
+    try:
+        bytecode.load(get_bytecode_cache_path())
+    except:
+        pass
+
+    set_template(template)
+
+
+def write_file(path, text):
+    """Write the specified string to the file at the specified path, unless
+    the file already contains exactly that string, in which case it is left
+    alone (so that its modification time does not change). Return True if the
+    file was written. The string is written to a temporary file in the same
+    directory, which then replaces the file, so that the file is never seen
+    half-written. If the --dry-run option is used, nothing is written.
+    """
+    try:
+        with io.open(path) as f:
+            if f.read() == text:
+                return False
+        st = os.stat(path)
+    except (IOError, OSError, ValueError):
+        # the file does not exist or cannot be decoded
+        st = None
+
+    if options.get('dry_run'):
+        return True
+
+    head, tail = os.path.split(path)
+
+    # the leading '.' makes the cleanup of the output directory ignore this
+    # file, if it is ever left behind
+    tmp_path = os.path.join(head, '.{}.{}.tmp'.format(tail, os.getpid()))
+
+    try:
+        with io.open(tmp_path, mode='w') as f:
+            f.write(text)
+
+        if st is not None:
+            # keep the permissions of the file being replaced
+            os.chmod(tmp_path, stat.S_IMODE(st.st_mode))
+
+        if hasattr(os, 'replace'):
+            os.replace(tmp_path, path)
+        else:
+            # os.rename() replaces the file atomically on POSIX systems
+            os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return True
+
+
+def copy_htaccess(path, relpath, result):
+    old_umask = os.umask(0o002)
+
+    head, tail = os.path.split(relpath)
+    relpath = os.path.join(head, '.htaccess')
+
+    output_path = os.path.join(config_get_filepath('output_dir'), relpath)
+
+    try:
+        for d in makedirs(os.path.dirname(output_path)):
+            result.log('info', "created directory '{}'".format(d))
+    except:
+        result.error("cannot make directories for htaccess '{}'".format(output_path))
+        os.umask(old_umask)
+        return False
+
+    was_here = os.path.isfile(output_path)
+
+    try:
+        with io.open(path) as htfile:
+            write_file(output_path, htfile.read())
+    except:
+        result.error("could not create htaccess '{}'".format(output_path))
+        os.umask(old_umask)
+        return False
+
+    if not was_here:
+        st = os.stat(output_path)
+        os.chmod(output_path, st.st_mode | stat.S_IXGRP | stat.S_IXOTH)
+
+    os.umask(old_umask)
+    result.log('info', "created htaccess file '{}'".format(output_path))
+    return True
+
+
+def mirror_asset(path, relpath, result):
+    output_path = os.path.join(config_get_filepath('output_dir'), relpath)
+
+    try:
+        for d in makedirs(os.path.dirname(output_path)):
+            result.log('info', "created directory '{}'".format(d))
+    except:
+        result.error("cannot make directories for '{}'".format(relpath))
+        return False
+
+    try:
+        method = assets.mirror(path, output_path)
+    except:
+        result.error("cannot mirror asset '{}'".format(relpath))
+        return False
+
+    if options.get('debug'):
+        result.log('info', "mirrored '{}' using {}".format(relpath, method))
+
+    return True
+
+
+def convert_file(infile, hash):
+    """Convert the Markdown file open for reading as infile, whose hash is
+    given, using an idle markdown.Markdown object and the template. Return
+    an (html, errors, inputs) tuple, where html and errors are as returned by
+    convert.md_to_html(), and inputs are the inputs the page read, as recorded
+    by presto.deps. This can be called by several threads at once.
+    """
+    try:
+        md = _idle_md.pop()
+    except IndexError:
+        md = make_markdown()
+
+    deps.start()
+    deps.record('template', _template_digest)
+
+    try:
+        html, errors = convert.md_to_html(md, _template, infile, {'hash': hash})
+    finally:
+        inputs = deps.stop()
+        md.reset()
+        _idle_md.append(md)
+
+    return html, errors, inputs
+
+
+def publish_file(task):
+    start = _clock()
+    result = _publish_file(task)
+
+    if result.status in ['published', 'identical']:
+        result.duration = _clock() - start
+
+    result.code_hits, result.code_misses = bytecode.take_stats()
+    result.sequence_times = convert.take_sequence_times(_SLOWEST_SEQUENCES)
+    result.new_code = bytecode.take_new()
+
+    return result
+
+
+def stopped_result(task, kind, sequence=None):
+    """Return a Result object for a task (see _publish_file()) whose worker
+    process was terminated (see watchdog.Pool), where kind is 'sequence' or
+    'page' if the page ran out of time, or None if the process exited by
+    itself, and sequence is a (seconds, location) tuple for the {-sequence
+    the process was running, or None.
+    """
+    path, relpath, cached = task
+    result = Result(relpath)
+    result.status = 'failed'
+
+    if sequence is None:
+        prefix = relpath
+    else:
+        prefix = '{}: {}'.format(relpath, sequence[1])
+
+        # the times of the other {-sequences of the page were lost with the
+        # process, but this one is likely to be the slowest
+        result.sequence_times = [sequence]
+
+    if kind is None:
+        result.error('{}: worker process exited unexpectedly'.format(prefix))
+    elif kind == 'sequence':
+        result.error('{}: {{-sequence took longer than {:g} seconds, and the page was '
+                     'stopped'.format(prefix, watchdog.get_limit('sequence_time_limit')))
+    else:
+        result.error('{}: page took longer than {:g} seconds, and was stopped'.format(
+            prefix, watchdog.get_limit('page_time_limit')
+        ))
+
+    return result
+
+
+def _publish_file(task):
+    """Given a (path, relpath, cache entry) tuple for a file found in the
+    Markdown directory, hash the file and, if it or any of the inputs it read
+    last time have changed, convert it and write its output file. Return a
+    Result object describing what happened. The cache entry is a tuple from
+    the build database (see presto.builddb), or None. Unless the --paranoid
+    option is used, a file whose stat key matches the cached one is not read
+    at all.
+    """
+    path, relpath, cached = task
+    result = Result(relpath)
+
+    if cached is None:
+        cached_hash = cached_stat = cached_inputs = None
+    else:
+        cached_hash, cached_stat, cached_inputs, result.output_digest, result.duration = cached
+
+    try:
+        result.stat = deps.get_stat_key(path)
+    except:
+        result.error("unable to read '{}'".format(relpath))
+        result.status = 'failed'
+        return result
+
+    if cached_stat == result.stat and not options.get('paranoid'):
+        result.hash = cached_hash
+    else:
+        try:
+            result.hash = compute_hash(path)
+        except:
+            result.error("unable to compute hash for '{}'".format(relpath))
+            result.status = 'failed'
+            return result
+
+    if cached_hash == result.hash and deps.unchanged(cached_inputs):
+        # no change to this file or its inputs since last time
+        result.deps = cached_inputs
+        return result
+
+    if not should_publish(path):
+        if not options.get('hide_skipped'):
+            result.log('skipped', relpath)
+        result.status = 'skipped'
+        return result
+
+    if os.path.basename(path) == 'htaccess':
+        result.deps = {}
+
+        # the file is copied as it is
+        result.output_digest = result.hash
+
+        if options.get('dry_run') or copy_htaccess(path, relpath, result):
+            result.status = 'published'
+        else:
+            result.status = 'failed'
+
+        return result
+
+    if not is_markdown(path):
+        # a static asset (see presto.assets), which is copied as it is
+        result.deps = {}
+        result.output_digest = result.hash
+
+        if options.get('dry_run') or mirror_asset(path, relpath, result):
+            result.status = 'published'
+            if not options.get('dry_run'):
+                result.bytes_written = os.stat(path).st_size
+            result.log('published', relpath)
+        else:
+            result.status = 'failed'
+
+        return result
+
+    try:
+        infile = io.open(path)
+    except:
+        result.error("unable to read '{}'".format(relpath))
+        result.status = 'failed'
+        return result
+
+    try:
+        with infile:
+            html, errors, result.deps = convert_file(infile, result.hash)
+    except:
+        result.error("unable to convert Markdown to HTML for '{}'".format(relpath))
+        result.status = 'failed'
+        return result
+
+    if errors:
+        for err in errors:
+            result.error('{}: {}'.format(relpath, err))
+
+        if not options.get('use_empty'):
+            result.status = 'skipped'
+            return result
+
+    # create path to output directory
+    output_path = os.path.join(config_get_filepath('output_dir'), extension_to_html(relpath))
+
+    try:
+        if not options.get('dry_run'):
+            for d in makedirs(os.path.dirname(output_path)):
+                result.log('info', "created directory '{}'".format(d))
+    except:
+        result.error("cannot make directories for '{}'".format(relpath))
+        result.status = 'failed'
+        return result
+
+    try:
+        written = write_file(output_path, html)
+    except:
+        result.error("cannot write output file '{}'".format(relpath))
+        result.status = 'failed'
+        return result
+
+    result.output_digest = deps.text_digest(html)
+
+    if written:
+        result.status = 'published'
+        if not options.get('dry_run'):
+            result.bytes_written = len(html.encode('utf-8'))
+        result.log('published', relpath)
+    else:
+        result.status = 'identical'
+        if not options.get('hide_skipped'):
+            result.log('identical', relpath)
+
+    return result
@@ -0,0 +1,231 @@
+"""This module provides the preview server (the "serve" command), an HTTP server
+that converts drafts from the Markdown directory when they are requested,
+without writing anything to the output directory. A URL is mapped to a draft
+the same way output files are mapped back to drafts when the output directory
+is cleaned up, so /foo/bar.html, /foo/bar and /foo/bar.markdown all refer to
+the draft foo/bar.markdown (or foo/bar.md), and /foo/ refers to foo/index.
+
+Rendered pages are kept in a least-recently-used cache. A cached page is used
+as long as the hash of its draft and the digests of the inputs it read (see
+presto.deps) have not changed.
+
+The metadata index (see presto.pageindex) is built when the server starts.
+The entry of each requested draft is brought up to date when it is requested,
+but the rest of the Markdown directory is scanned again at most once every
+_SCAN_INTERVAL seconds, so that a request does not have to stat every draft.
+"""
+from __future__ import print_function, with_statement
+
+import os
+import io
+import time
+import threading
+import collections
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import urlparse, unquote
+
+import presto.output as output
+import presto.options as options
+import presto.publish as publish
+import presto.build as build
+import presto.deps as deps
+import presto.bytecode as bytecode
+import presto.pageindex as pageindex
+from presto.publish import (config_get_filepath, compute_hash, should_publish,
+                            extension_drop)
+
+
+_CACHE_SIZE = 256                   # number of rendered pages to keep
+_SCAN_INTERVAL = 2.0                # least number of seconds between scans of
+                                    # the Markdown directory
+
+# pages are converted by the threads handling requests at the same time, but
+# only one thread at a time checks whether the template file has changed and
+# updates the metadata index
+_lock = threading.Lock()
+
+_template_digest = None             # digest of the template file when loaded
+_last_scan = None                   # time of the last scan of the index
+
+
+class PageCache(object):
+    """A cache of rendered pages, mapping the relative path of a draft to a
+    (hash, inputs, html) tuple, which discards the least recently used page
+    when it is full.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._pages = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, relpath, hash):
+        """Return the cached HTML of the draft with the specified relative path,
+        or None if it is not cached or it or its inputs have changed.
+        """
+        with self._lock:
+            entry = self._pages.pop(relpath, None)
+
+        if entry is None:
+            return None
+
+        cached_hash, inputs, html = entry
+
+        if cached_hash != hash or not deps.unchanged(inputs):
+            return None
+
+        # move the page to the most recently used end
+        self.put(relpath, cached_hash, inputs, html)
+        return html
+
+    def put(self, relpath, hash, inputs, html):
+        with self._lock:
+            self._pages.pop(relpath, None)
+            self._pages[relpath] = (hash, inputs, html)
+
+            while len(self._pages) > self.size:
+                self._pages.popitem(last=False)
+
+
+_pages = PageCache(_CACHE_SIZE)
+
+
+def find_draft(url):
+    """Return the relative path of the draft in the Markdown directory that the
+    specified URL refers to, or None if there is no such draft.
+    """
+    path = unquote(urlparse(url).path).lstrip('/')
+
+    if path == '' or path.endswith('/'):
+        path += 'index'
+
+    if '..' in path.split('/') or not should_publish(path):
+        return None
+
+    base = extension_drop(path)
+
+    for ext in ['.markdown', '.md']:
+        relpath = base + ext
+
+        if os.path.isfile(os.path.join(config_get_filepath('markdown_dir'), relpath)):
+            return relpath
+
+    return None
+
+
+def load_template():
+    global _template_digest
+
+    publish.set_template(build.load_template())
+    _template_digest = deps.current_digest('template')
+
+
+def scan_index():
+    global _last_scan
+
+    pageindex.scan()
+    _last_scan = time.time()
+
+
+def render(relpath):
+    """Return an (html, errors) tuple for the draft with the specified relative
+    path, using the cached page if possible. If the page could not be rendered,
+    html is None.
+    """
+    path = os.path.join(config_get_filepath('markdown_dir'), relpath)
+
+    with _lock:
+        # see changes made to partials, drafts, etc. since the last request
+        deps.clear()
+
+        if deps.current_digest('template') != _template_digest:
+            load_template()
+
+        if time.time() - _last_scan >= _SCAN_INTERVAL:
+            scan_index()
+        else:
+            pageindex.update(path, relpath)
+
+    hash = compute_hash(path)
+
+    html = _pages.get(relpath, hash)
+    if html is not None:
+        return html, []
+
+    with io.open(path) as infile:
+        html, errors, inputs = publish.convert_file(infile, hash)
+
+    if html is not None:
+        _pages.put(relpath, hash, inputs, html)
+
+    return html, errors
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        relpath = find_draft(self.path)
+
+        if relpath is None:
+            self.send_text(404, 'no draft found for {}\n'.format(self.path))
+            return
+
+        try:
+            html, errors = render(relpath)
+        except:
+            if options.get('debug'):
+                output.traceback()
+
+            output.error("unable to convert Markdown to HTML for '{}'".format(relpath))
+            self.send_text(500, "unable to convert Markdown to HTML for '{}'\n".format(relpath))
+            return
+
+        for err in errors:
+            output.error('{}: {}'.format(relpath, err))
+
+        if html is None:
+            self.send_text(500, ''.join('{}: {}\n'.format(relpath, err) for err in errors))
+        else:
+            self.send_body(200, 'text/html', html)
+
+    def send_text(self, code, text):
+        self.send_body(code, 'text/plain', text)
+
+    def send_body(self, code, content_type, text):
+        body = text.encode('utf-8')
+
+        self.send_response(code)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def serve():
+    try:
+        bytecode.load(publish.get_bytecode_cache_path())
+    except:
+        if options.get('debug'):
+            output.traceback()
+
+        output.error('could not open bytecode cache file')
+
+    load_template()
+    scan_index()
+
+    server = Server((options.get('bind'), options.get('port')), Handler)
+    output.status('serving drafts on http://{}:{}/ (press Ctrl-C to stop)'.format(
+        options.get('bind'), options.get('port')
+    ))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,163 @@
+"""This module provides sharded builds (the --shard option), which let a full
+build of a large site be split between several machines. The drafts are
+partitioned into N shards using a stable hash of their relative paths, so
+every machine agrees on which shard a draft belongs to. Each machine publishes
+one shard and writes a manifest of the output files it is responsible for,
+without cleaning up the output directory, since it has not seen the others'
+files. Once the output of every shard has been gathered into one output
+directory, the "merge-manifests" command removes the orphaned files from it,
+keeping every file listed in the manifests.
+"""
+from __future__ import print_function, with_statement
+
+import os
+import io
+import json
+import hashlib
+
+import six
+
+import presto.output as output
+import presto.options as options
+import presto.builddb as builddb
+import presto.build as build
+from presto.publish import (config_get_filepath, should_publish,
+                            extension_to_html, extension_drop)
+
+
+def in_shard(relpath, shard):
+    """Given the relative path of a draft and an (I, N) tuple, return True if
+    the draft belongs to shard I of N.
+    """
+    i, n = shard
+
+    h = hashlib.md5(relpath.encode('utf-8') if isinstance(relpath, six.text_type) else relpath)
+    return int(h.hexdigest(), 16) % n == i - 1
+
+
+def is_shard(i, n):
+    """Return True if shard I of N can exist, that is, if I and N are integers
+    and 1 <= I <= N.
+    """
+    for value in [i, n]:
+        if isinstance(value, bool) or not isinstance(value, six.integer_types):
+            return False
+
+    return 1 <= i <= n
+
+
+def get_manifest_path(shard):
+    path = options.get('manifest')
+
+    if path is None:
+        path = '{}.shard-{}-of-{}.json'.format(config_get_filepath('cache_file'), *shard)
+
+    return path
+
+
+def write_manifest(path, shard, tasks, cache):
+    """Write the manifest of the specified shard, given the tasks of the shard
+    (see build.find_files()) and the build database after publishing them.
+    For each draft that should be published, the manifest lists its output
+    file and the digests of both files.
+    """
+    files = {}
+
+    for _, relpath, _ in tasks:
+        if not should_publish(relpath):
+            continue
+
+        entry = cache.get(relpath)
+        hash, output_digest = (None, None) if entry is None else (entry[0], entry[3])
+
+        head, tail = os.path.split(relpath)
+        if tail == 'htaccess':
+            output_path = os.path.join(head, '.htaccess')
+        else:
+            output_path = extension_to_html(relpath)
+
+        files[relpath] = {
+            'expected': extension_drop(relpath),
+            'output': output_path,
+            'hash': hash,
+            'output_digest': output_digest
+        }
+
+    manifest = {'shard': list(shard), 'files': files}
+
+    with io.open(path, mode='w') as f:
+        f.write(six.text_type(json.dumps(manifest, indent=2, sort_keys=True)))
+
+
+def read_manifest(path):
+    with io.open(path) as f:
+        return json.loads(f.read())
+
+
+def merge(paths):
+    """Read the manifests written by every shard of a build and remove the
+    output files that are not listed in any of them. Nothing is removed
+    unless there is exactly one manifest for each of the N shards (all with
+    the same N, and none for a shard that cannot exist), since the output
+    files of a missing shard would otherwise be removed. Return a
+    build.Summary object.
+    """
+    summary = build.Summary()
+    shards = {}
+
+    for path in paths:
+        try:
+            manifest = read_manifest(path)
+            i, n = manifest['shard']
+        except:
+            if options.get('debug'):
+                output.traceback()
+
+            output.error("could not read manifest '{}'".format(path))
+            summary.errors += 1
+            return summary
+
+        if not is_shard(i, n):
+            output.error("manifest '{}' is for shard {} of {}, which does not "
+                         "exist".format(path, i, n))
+            summary.errors += 1
+            return summary
+
+        if not shards:
+            first_path, num_shards = path, n
+
+        elif n != num_shards:
+            output.error("manifests '{}' and '{}' are from builds split into {} "
+                         "and {} shards".format(first_path, path, num_shards, n))
+            summary.errors += 1
+            return summary
+
+        if (i, n) in shards:
+            output.error("manifests '{}' and '{}' are both for shard {} of {}".format(
+                shards[(i, n)][0], path, i, n
+            ))
+            summary.errors += 1
+            return summary
+
+        shards[(i, n)] = (path, manifest)
+
+    if not shards:
+        return summary
+
+    missing = [str(i) for i in range(1, num_shards + 1) if (i, num_shards) not in shards]
+
+    if missing:
+        output.error('missing manifests for shards {} of {}'.format(
+            ', '.join(missing), num_shards))
+        summary.errors += 1
+        return summary
+
+    expected_files = set()
+    for path, manifest in shards.values():
+        for f in manifest['files'].values():
+            expected_files.add(f['expected'])
+
+    # the build database is not used, since no drafts are published
+    build.remove_orphans(expected_files, builddb.Cache(), summary)
+
+    return summary
@@ -0,0 +1,140 @@
+"""This module provides watch mode (the --watch option), in which Presto keeps
+running after publishing, polls the Markdown directory, the partials directory,
+the template file and presto.ini for changes, and publishes again whenever
+something changes. Only the standard library is used, so changes are found by
+comparing the results of os.stat() every so often.
+
+Since the process stays alive, the markdown.Markdown object, the compiled
+template and the modules imported by Pygments stay loaded between builds, and
+the dependency tracking in presto.deps makes sure that only the pages affected
+by a change are published again.
+"""
+from __future__ import print_function
+
+import os
+import time
+
+import presto.output as output
+import presto.config as config
+import presto.options as options
+import presto.build as build
+
+
+_INTERVAL = 0.5                     # seconds between polls
+
+
+def _watched_paths():
+    """Return a (directories, files) tuple of the paths that should be
+    watched, according to the configuration file.
+    """
+    dirs = [config.get_filepath('markdown_dir'), config.get_filepath('partials_dir')]
+    files = [config.get_ini_path(), config.get_filepath('template_file')]
+
+    return [d for d in dirs if d is not None], [f for f in files if f is not None]
+
+
+def snapshot():
+    """Return a dictionary mapping the path of every watched file to a tuple
+    of its modification time and size.
+    """
+    snap = {}
+    dirs, files = _watched_paths()
+
+    for d in dirs:
+        for dirpath, dirnames, filenames in os.walk(d):
+            files.extend(os.path.join(dirpath, f) for f in filenames)
+
+    for path in files:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+
+        snap[path] = (st.st_mtime, st.st_size)
+
+    return snap
+
+
+def watch():
+    summary = build.Summary()
+    cache = build.load_caches(summary)
+    template = build.load_template()
+
+    before = snapshot()
+    build.build(template, cache, summary)
+    output.summary(summary)
+    output.status('watching for changes (press Ctrl-C to stop)')
+
+    ini_ok = True
+
+    try:
+        while True:
+            time.sleep(_INTERVAL)
+
+            after = snapshot()
+            if after == before:
+                continue
+
+            changed = set(p for p in set(before) | set(after)
+                          if before.get(p) != after.get(p))
+            before = after
+
+            if config.get_ini_path() in changed:
+                ini_ok = _reload_config()
+
+                # the watched directories may have changed with presto.ini
+                before = snapshot()
+
+            if not ini_ok:
+                # publishing with a broken presto.ini would only fail, so wait
+                # until it is fixed
+                continue
+
+            if (config.get_ini_path() in changed or
+                    config.get_filepath('template_file') in changed):
+                try:
+                    template = build.load_template()
+                except:
+                    if options.get('debug'):
+                        output.traceback()
+
+                    output.error('could not read template file')
+                    continue
+
+            summary = build.Summary()
+
+            try:
+                build.build(template, cache, summary)
+            except Exception:
+                if options.get('debug'):
+                    output.traceback()
+
+                output.error('could not publish the changes')
+                summary.errors += 1
+
+            output.summary(summary)
+
+    except KeyboardInterrupt:
+        pass
+
+
+def _reload_config():
+    """Load presto.ini again after it has changed, and return True if it could
+    be loaded. Since presto.ini may be saved while it is only half edited, an
+    error is reported instead of ending watch mode.
+    """
+    try:
+        config.load(path=config.get_ini_path())
+        return True
+    except SystemExit:
+        # config.load() has already reported the problem
+        pass
+    except Exception:
+        if options.get('debug'):
+            output.traceback()
+
+        output.error('could not read configuration file: {}'.format(
+            config.get_ini_path()))
+
+    output.status('waiting for presto.ini to be fixed')
+    return False
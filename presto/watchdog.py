@@ -0,0 +1,464 @@
+"""This module enforces the time budgets given by the sequence_time_limit and
+page_time_limit options in presto.ini (in seconds), so that a {-sequence that
+runs for too long (such as one stuck in an endless loop) does not stall the
+whole publish. It does so in two ways.
+
+First, code is run within a budget using limit(); a watchdog thread raises an
+exception in the thread running the code once the budget has run out, and
+keeps raising it until the code gives up, in case the code catches it. The
+exception is raised asynchronously, so that no cost is added to code that
+finishes in time, and the page can be reported with the line number of the
+{-sequence that ran out of time. However, the exception is only seen when the
+thread checks for it, which many kinds of code never do: a call that blocks
+(such as time.sleep()) runs to the end, and before Python 3.11, a loop whose
+body begins with a try statement never checks for it, nor lets the watchdog
+thread run. Code that catches every exception with a bare "except:" is never
+stopped by it either.
+
+Second, so that such code cannot stall the publish forever, when a time
+limit is set, pages are published by worker processes run by a Pool (see
+has_limits()), each of which tells the main process when its nearest
+deadline is, and which {-sequence it is running (see limit()). A worker
+process that is still running _KILL_GRACE seconds after its deadline is
+terminated and replaced, and its page is reported as an error, with the line
+number of that {-sequence and the time it had taken. The "serve" command
+converts pages in threads, which cannot be terminated, so it relies on the
+exception alone.
+"""
+from __future__ import with_statement
+
+import os
+import time
+import signal
+import threading
+import collections
+
+import presto.config as config
+
+
+_POLL_INTERVAL = 0.05               # seconds between checks of the deadlines
+_REPEAT_INTERVAL = 0.1              # seconds between raising the exception
+                                    # again, if the code caught it
+_KILL_GRACE = 0.5                   # seconds a worker process of a Pool has to
+                                    # stop by itself after its deadline
+_LOCATION_SIZE = 64                 # bytes kept of the location of the
+                                    # {-sequence a worker process is running
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+class TimeLimitExceeded(BaseException):
+    """Raised in code that ran out of time. It is not an Exception, so that
+    code catching every Exception (such as a {-sequence) does not catch it.
+    """
+    pass
+
+
+class SequenceTimeLimitExceeded(TimeLimitExceeded):
+    pass
+
+
+class PageTimeLimitExceeded(TimeLimitExceeded):
+    pass
+
+
+_EXCEPTIONS = {
+    'sequence': SequenceTimeLimitExceeded,
+    'page': PageTimeLimitExceeded
+}
+
+_KINDS = ['sequence', 'page']
+
+
+class _Budgets(object):
+    """The deadlines of the code being run by one thread."""
+
+    def __init__(self):
+        self.deadlines = {}         # 'sequence' or 'page' -> deadline
+        self.raised_at = None       # time the exception was last raised
+
+    def next_raise(self):
+        """Return a (time, exception type) tuple for when the exception should
+        next be raised, or None if there are no deadlines.
+        """
+        if not self.deadlines:
+            return None
+
+        kind = min(self.deadlines, key=lambda kind: self.deadlines[kind])
+        when = self.deadlines[kind]
+
+        if self.raised_at is not None:
+            when = max(when, self.raised_at + _REPEAT_INTERVAL)
+
+        return when, _EXCEPTIONS[kind]
+
+
+# a plain lock, rather than a threading.Condition, since the exception may be
+# raised while the lock is being acquired, and a Condition (written in Python)
+# could then be left locked
+_lock = threading.Lock()
+_budgets = {}                       # thread identifier -> _Budgets
+_watchdog_pid = None                # the process the watchdog thread runs in
+
+# in a worker process of a Pool, an array shared with the main process, holding
+# the nearest deadline (as a time.time() value, or 0.0 if there is none), the
+# index in _KINDS of its kind, and when the {-sequence being run began (as a
+# time.time() value, or 0.0 if none is), and a string shared with the main
+# process, holding the location of that {-sequence (see limit())
+_shared = None
+_shared_location = None
+
+
+def get_limit(name):
+    """Return the time limit (in seconds) given by the specified option in
+    presto.ini, or None if there is no limit.
+    """
+    value = config.get(name)
+
+    if value is None or not value.strip():
+        return None
+
+    seconds = float(value)
+    return seconds if seconds > 0 else None
+
+
+def has_limits():
+    """Return True if either time limit is set in presto.ini."""
+    return (get_limit('sequence_time_limit') is not None or
+            get_limit('page_time_limit') is not None)
+
+
+def _set_async_exc(ident, exc_type):
+    """Raise an exception of the specified type in the thread with the
+    specified identifier, or if exc_type is None, cancel one that has not
+    been raised yet.
+    """
+    import ctypes
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(ident), None if exc_type is None else ctypes.py_object(exc_type)
+    )
+
+
+def _watch():
+    while True:
+        with _lock:
+            now = _clock()
+
+            for ident, budgets in _budgets.items():
+                due = budgets.next_raise()
+
+                if due is not None and due[0] <= now:
+                    _set_async_exc(ident, due[1])
+                    budgets.raised_at = now
+
+        time.sleep(_POLL_INTERVAL)
+
+
+def _share_deadline(budgets):
+    # tell the Pool running this process (if any) when the nearest deadline of
+    # the thread is, so that the process can be terminated if the code does
+    # not stop; called with _lock held
+    if _shared is None:
+        return
+
+    if budgets is None or not budgets.deadlines:
+        _shared[0] = 0.0
+        return
+
+    kind = min(budgets.deadlines, key=lambda kind: budgets.deadlines[kind])
+
+    _shared[1] = _KINDS.index(kind)
+    _shared[0] = time.time() + (budgets.deadlines[kind] - _clock())
+
+
+def _share_location(location):
+    # tell the Pool running this process (if any) which {-sequence is being
+    # run, so that it can be reported if the process is terminated
+    if _shared is None:
+        return
+
+    if location is None:
+        _shared[2] = 0.0
+        _shared_location.value = b''
+    else:
+        _shared_location.value = location.encode('utf-8')[:_LOCATION_SIZE - 1]
+        _shared[2] = time.time()
+
+
+def _start_watchdog():
+    global _watchdog_pid
+
+    # a worker process (see the --jobs option) does not inherit the thread
+    if _watchdog_pid != os.getpid():
+        _watchdog_pid = os.getpid()
+
+        thread = threading.Thread(target=_watch, name='presto-watchdog')
+        thread.daemon = True
+        thread.start()
+
+
+def limit(kind, seconds, location=None):
+    """Return a context manager that runs the code within it with a budget of
+    the specified number of seconds, where kind is 'sequence' or 'page',
+    raising SequenceTimeLimitExceeded or PageTimeLimitExceeded when the budget
+    runs out. If seconds is None, there is no limit. Budgets of different
+    kinds can be nested. The location of a {-sequence (such as "line 12") is
+    used to report it if its worker process is terminated (see Pool), even if
+    only the page has a limit.
+    """
+    return _Limit(kind, seconds, location)
+
+
+class _Limit(object):
+    """See limit()."""
+
+    def __init__(self, kind, seconds, location=None):
+        self.kind = kind
+        self.seconds = seconds
+        self.location = location
+
+    def __enter__(self):
+        if self.location is not None:
+            _share_location(self.location)
+
+        if self.seconds is None:
+            return
+
+        self.ident = threading.current_thread().ident
+
+        with _lock:
+            _start_watchdog()
+
+            budgets = _budgets.get(self.ident)
+            if budgets is None:
+                budgets = _budgets[self.ident] = _Budgets()
+
+            budgets.deadlines[self.kind] = _clock() + self.seconds
+            _share_deadline(budgets)
+
+    def __exit__(self, exc_type, exc_value, tb):
+        # the exception may be raised while the budget is being removed, in
+        # which case removing it is simply tried again
+        while True:
+            try:
+                if self.seconds is not None:
+                    self._remove()
+
+                if self.location is not None:
+                    _share_location(None)
+
+                break
+            except TimeLimitExceeded:
+                pass
+
+        return False
+
+    def _remove(self):
+        with _lock:
+            budgets = _budgets.get(self.ident)
+            if budgets is None:
+                # already removed, before the exception was raised
+                return
+
+            budgets.deadlines.pop(self.kind, None)
+
+            if budgets.raised_at is not None:
+                # cancel the exception, if it has not been raised yet; if an
+                # outer budget has run out too, it will be raised again
+                _set_async_exc(self.ident, None)
+                budgets.raised_at = None
+
+            if not budgets.deadlines:
+                del _budgets[self.ident]
+
+            _share_deadline(budgets)
+
+
+def _worker_main(conn, shared, location, func, initializer, initargs):
+    """Run in a worker process of a Pool: call func with each task received
+    from the specified connection, and send back what it returns, until None
+    is received.
+    """
+    global _shared, _shared_location
+    _shared, _shared_location = shared, location
+
+    # a Ctrl-C is handled by the main process, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    initializer(*initargs)
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+
+        if task is None:
+            break
+
+        conn.send(func(task))
+
+
+def _wait(conns, timeout):
+    """Wait until one of the specified connections can be read, or until the
+    specified number of seconds have passed.
+    """
+    try:
+        from multiprocessing.connection import wait
+    except ImportError:
+        # Python 2
+        time.sleep(min(timeout, 0.01))
+        return
+
+    wait(conns, timeout)
+
+
+class _Worker(object):
+    """A worker process of a Pool, and the index of the task it is running (or
+    None if it is idle).
+    """
+
+    def __init__(self, func, initializer, initargs):
+        import multiprocessing
+
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.shared = multiprocessing.RawArray('d', 3)
+        self.location = multiprocessing.RawArray('c', _LOCATION_SIZE)
+        self.index = None
+
+        self.process = multiprocessing.Process(
+            target=_worker_main,
+            args=(child_conn, self.shared, self.location, func, initializer, initargs)
+        )
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+    def overdue(self):
+        """Return the kind of the deadline ('sequence' or 'page') that passed
+        more than _KILL_GRACE seconds ago, or None if none did.
+        """
+        deadline = self.shared[0]
+
+        if deadline and time.time() > deadline + _KILL_GRACE:
+            return _KINDS[int(self.shared[1])]
+
+        return None
+
+    def sequence(self):
+        """Return a (seconds, location) tuple for the {-sequence the worker
+        process is running, where seconds is how long it has been running, or
+        None if it is not running one.
+        """
+        start = self.shared[2]
+        location = self.location.value.decode('utf-8', 'replace')
+
+        if not start or not location:
+            return None
+
+        return time.time() - start, location
+
+    def stop(self):
+        if self.process.is_alive():
+            self.process.terminate()
+
+        self.process.join()
+        self.conn.close()
+
+
+class Pool(object):
+    """A pool of worker processes publishing pages, like multiprocessing.Pool,
+    except that a worker process whose page runs out of time and does not stop
+    by itself is terminated and replaced by a new one. Use imap(), and then
+    close() and join().
+    """
+
+    def __init__(self, processes, initializer, initargs):
+        self.processes = max(1, processes)
+        self.initializer = initializer
+        self.initargs = initargs
+        self.workers = []
+
+    def _start(self, func):
+        worker = _Worker(func, self.initializer, self.initargs)
+        self.workers.append(worker)
+        return worker
+
+    def _replace(self, worker, func):
+        worker.stop()
+        self.workers.remove(worker)
+        return self._start(func)
+
+    def imap(self, func, tasks, stopped):
+        """Call func with each task in a worker process, and generate what it
+        returns, in the order of the tasks. For a task whose worker process
+        was terminated, generate stopped(task, kind, sequence) instead, where
+        kind is 'sequence' or 'page' if the task ran out of time, or None if
+        the process exited by itself, and sequence is a (seconds, location)
+        tuple for the {-sequence it was running (see _Worker.sequence()), or
+        None.
+        """
+        tasks = list(tasks)
+        queue = collections.deque(range(len(tasks)))
+        results = {}
+        next_index = 0
+
+        idle = [self._start(func) for _ in range(min(self.processes, len(tasks)))]
+        busy = []
+
+        while next_index < len(tasks):
+            if next_index in results:
+                yield results.pop(next_index)
+                next_index += 1
+                continue
+
+            while idle and queue:
+                worker = idle.pop()
+                worker.index = queue.popleft()
+                worker.conn.send(tasks[worker.index])
+                busy.append(worker)
+
+            _wait([worker.conn for worker in busy], _POLL_INTERVAL)
+
+            for worker in list(busy):
+                index = worker.index
+
+                if worker.conn.poll():
+                    try:
+                        results[index] = worker.conn.recv()
+                        worker.index = None
+                        busy.remove(worker)
+                        idle.append(worker)
+                        continue
+                    except EOFError:
+                        kind = None
+                elif not worker.process.is_alive():
+                    kind = None
+                else:
+                    kind = worker.overdue()
+                    if kind is None:
+                        continue
+
+                results[index] = stopped(tasks[index], kind, worker.sequence())
+                busy.remove(worker)
+                idle.append(self._replace(worker, func))
+
+    def close(self):
+        for worker in self.workers:
+            if worker.index is None and worker.process.is_alive():
+                try:
+                    worker.conn.send(None)
+                except (IOError, OSError):
+                    pass
+
+    def join(self):
+        """Wait for the idle worker processes to exit, and terminate the others
+        (such as when the run is interrupted).
+        """
+        for worker in self.workers:
+            if worker.index is None:
+                worker.process.join()
+
+            worker.stop()
+
+        self.workers = []
@@ -0,0 +1,88 @@
+"""This module provides a small site in a temporary directory for the tests to
+publish, and a way to run Presto on it as a separate process, just as it is
+run from the command line.
+"""
+from __future__ import print_function, with_statement
+
+import os
+import io
+import sys
+import shutil
+import tempfile
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+INI = u'''[presto]
+markdown_dir = drafts
+partials_dir = partials
+output_dir = output
+template_file = template.html
+cache_file = cache
+whitelist =
+{presto}
+
+[variables]
+{variables}
+'''
+
+TEMPLATE = u'{= content =}\n'
+
+
+class Site(object):
+    """A site in a temporary directory, made of the specified drafts (a
+    dictionary mapping relative paths to contents), with the specified options
+    in the [presto] and [variables] sections of presto.ini (dictionaries
+    mapping names to values).
+    """
+
+    def __init__(self, drafts, presto=None, variables=None):
+        self.dir = tempfile.mkdtemp(prefix='presto-test-')
+
+        os.mkdir(self.path('drafts'))
+        os.mkdir(self.path('partials'))
+
+        self.write('template.html', TEMPLATE)
+        self.write_ini(presto, variables)
+
+        for relpath, contents in drafts.items():
+            self.write(os.path.join('drafts', relpath), contents)
+
+    def path(self, relpath):
+        return os.path.join(self.dir, relpath)
+
+    def write(self, relpath, contents):
+        dirpath = os.path.dirname(self.path(relpath))
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+
+        with io.open(self.path(relpath), 'w', encoding='utf-8') as f:
+            f.write(contents)
+
+    def read(self, relpath):
+        with io.open(self.path(relpath), encoding='utf-8') as f:
+            return f.read()
+
+    def write_ini(self, presto=None, variables=None):
+        def lines(options):
+            return u'\n'.join(u'{} = {}'.format(name, value)
+                              for name, value in sorted((options or {}).items()))
+
+        self.write('presto.ini', INI.format(presto=lines(presto),
+                                            variables=lines(variables)))
+
+    def run(self, *args):
+        """Run Presto with the specified command line arguments in the site's
+        directory, and return a (return code, output) tuple.
+        """
+        env = dict(os.environ)
+        env['PYTHONPATH'] = REPO_DIR
+
+        proc = subprocess.Popen([sys.executable, '-m', 'presto'] + list(args),
+                                cwd=self.dir, env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out, _ = proc.communicate()
+        return proc.returncode, out.decode('utf-8', 'replace')
+
+    def remove(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
@@ -0,0 +1,33 @@
+from __future__ import print_function, with_statement
+
+import os
+import unittest
+
+from tests.site import Site
+
+
+class OrphanTest(unittest.TestCase):
+    """Output files of drafts that no longer exist are removed, along with the
+    directories they leave empty, but not the output directory itself.
+    """
+
+    def setUp(self):
+        self.site = Site({'a.md': u'a\n', 'sub/b.md': u'b\n'})
+        self.addCleanup(self.site.remove)
+
+        code, out = self.site.run()
+        self.assertEqual(code, 0, out)
+
+    def test_every_file_orphaned(self):
+        os.remove(self.site.path('drafts/a.md'))
+        os.remove(self.site.path('drafts/sub/b.md'))
+
+        code, out = self.site.run()
+        self.assertEqual(code, 0, out)
+
+        self.assertTrue(os.path.isdir(self.site.path('output')))
+        self.assertEqual(os.listdir(self.site.path('output')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
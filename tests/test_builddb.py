@@ -0,0 +1,58 @@
+from __future__ import print_function, with_statement
+
+import os
+import io
+import sqlite3
+import unittest
+
+from tests.site import Site
+
+
+class ReadOnlyTest(unittest.TestCase):
+    """The "plan" command and dry runs do not create or change the build
+    database.
+    """
+
+    def setUp(self):
+        self.site = Site({'a.md': u'a\n'})
+        self.addCleanup(self.site.remove)
+
+    def read_cache(self):
+        with io.open(self.site.path('cache'), mode='rb') as f:
+            return f.read()
+
+    def test_missing_database(self):
+        for args in [['plan'], ['--dry-run']]:
+            code, out = self.site.run(*args)
+            self.assertEqual(code, 0, out)
+            self.assertFalse(os.path.exists(self.site.path('cache')))
+
+    def test_existing_database(self):
+        code, out = self.site.run()
+        self.assertEqual(code, 0, out)
+        before = self.read_cache()
+
+        self.site.write('drafts/a.md', u'changed\n')
+
+        for args in [['plan'], ['--dry-run']]:
+            code, out = self.site.run(*args)
+            self.assertEqual(code, 0, out)
+            self.assertEqual(self.read_cache(), before)
+
+    def test_locked_database(self):
+        code, out = self.site.run()
+        self.assertEqual(code, 0, out)
+
+        # as a build in another process would
+        conn = sqlite3.connect(self.site.path('cache'), isolation_level=None)
+        self.addCleanup(conn.close)
+        conn.execute('BEGIN IMMEDIATE')
+
+        for args in [['plan'], ['--dry-run']]:
+            code, out = self.site.run(*args)
+            self.assertEqual(code, 0, out)
+            self.assertIn('; 0 errors', out)
+
+
+if __name__ == '__main__':
+    unittest.main()
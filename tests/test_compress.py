@@ -0,0 +1,70 @@
+from __future__ import print_function, with_statement
+
+import os
+import io
+import gzip
+import unittest
+
+from tests.site import Site
+
+
+class SidecarTest(unittest.TestCase):
+    """gzip sidecars are written again whenever they may be out of date."""
+
+    BODY = u'word ' * 200 + u'\n'
+
+    def setUp(self):
+        self.site = Site({'a.md': self.BODY, 'b.md': self.BODY},
+                         presto={'gzip': 'yes', 'gzip_level': '1'})
+        self.addCleanup(self.site.remove)
+
+        code, out = self.site.run()
+        self.assertEqual(code, 0, out)
+
+    def read_sidecar(self, relpath):
+        with gzip.open(self.site.path(relpath + '.gz')) as f:
+            return f.read().decode('utf-8')
+
+    def read_raw(self, relpath):
+        with io.open(self.site.path(relpath + '.gz'), mode='rb') as f:
+            return f.read()
+
+    def test_older_html_file(self):
+        # as if output/a.html were restored from an older backup
+        path = self.site.path('output/a.html')
+        self.site.write('output/a.html', u'restored ' * 100)
+        st = os.stat(path)
+        os.utime(path, (st.st_atime - 3600, st.st_mtime - 3600))
+
+        code, out = self.site.run()
+        self.assertEqual(code, 0, out)
+
+        self.assertEqual(self.read_sidecar('output/a.html'),
+                         self.site.read('output/a.html'))
+
+    def test_changed_level(self):
+        before = self.read_raw('output/b.html')
+
+        self.site.write_ini(presto={'gzip': 'yes', 'gzip_level': '9'})
+        code, out = self.site.run()
+        self.assertEqual(code, 0, out)
+
+        self.assertNotEqual(self.read_raw('output/b.html'), before)
+        self.assertEqual(self.read_sidecar('output/b.html'),
+                         self.site.read('output/b.html'))
+
+    def test_invalid_level(self):
+        self.site.write_ini(presto={'gzip': 'yes', 'gzip_level': 'fast'})
+        self.site.write('drafts/a.md', u'changed ' * 100)
+
+        code, out = self.site.run()
+        self.assertIn('gzip_level', out)
+        self.assertNotIn('Traceback', out)
+
+        # the page is still published, without an out-of-date sidecar
+        self.assertIn('changed', self.site.read('output/a.html'))
+        self.assertFalse(os.path.exists(self.site.path('output/a.html.gz')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+from __future__ import print_function, with_statement
+
+import unittest
+
+from tests.site import Site
+
+
+class NamespaceTest(unittest.TestCase):
+    """The functions in presto.functions are in scope for every page, except
+    for its private helpers.
+    """
+
+    def setUp(self):
+        self.site = Site({
+            'public.md': u"{= callable(partial) and callable(draft) =}\n",
+            'private.md': u"{= [name for name in dir() if name.startswith('_')] =}\n",
+        })
+        self.addCleanup(self.site.remove)
+
+        code, out = self.site.run()
+        self.assertEqual(code, 0, out)
+
+    def test_public_functions(self):
+        self.assertIn('True', self.site.read('output/public.html'))
+
+    def test_private_helpers(self):
+        self.assertIn('[]', self.site.read('output/private.html'))
+
+
+if __name__ == '__main__':
+    unittest.main()
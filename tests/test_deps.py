@@ -0,0 +1,54 @@
+from __future__ import print_function, with_statement
+
+import unittest
+
+from tests.site import Site
+
+
+class VariableTest(unittest.TestCase):
+    """Pages reading variables from presto.ini are published again when the
+    variables change, however they are read.
+    """
+
+    DRAFTS = {
+        'get.md': u"{= config.get('zz') =}\n",
+        'missing.md': u"{= config.get('yy', 'none') =}\n",
+        'contains.md': u"{= 'zz' in config =}\n",
+        'items.md': u"{= sorted(config.items()) =}\n",
+    }
+
+    def setUp(self):
+        self.site = Site(self.DRAFTS, variables={'zz': 'old'})
+        self.addCleanup(self.site.remove)
+
+        code, out = self.site.run()
+        self.assertEqual(code, 0, out)
+
+    def test_changed_variable(self):
+        self.site.write_ini(variables={'zz': 'new'})
+        code, out = self.site.run()
+        self.assertEqual(code, 0, out)
+
+        self.assertIn('new', self.site.read('output/get.html'))
+        self.assertIn('new', self.site.read('output/items.html'))
+        self.assertIn('none', self.site.read('output/missing.html'))
+
+    def test_added_variable(self):
+        self.site.write_ini(variables={'zz': 'old', 'yy': 'added'})
+        code, out = self.site.run()
+        self.assertEqual(code, 0, out)
+
+        self.assertIn('added', self.site.read('output/missing.html'))
+        self.assertIn('added', self.site.read('output/items.html'))
+
+    def test_removed_variable(self):
+        self.site.write_ini()
+        code, out = self.site.run()
+        self.assertEqual(code, 0, out)
+
+        self.assertIn('False', self.site.read('output/contains.html'))
+        self.assertIn('None', self.site.read('output/get.html'))
+
+
+if __name__ == '__main__':
+    unittest.main()
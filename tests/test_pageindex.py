@@ -0,0 +1,32 @@
+from __future__ import print_function, with_statement
+
+import unittest
+
+from tests.site import Site
+
+
+class SortTest(unittest.TestCase):
+    """pages() can sort by a variable whose values have different types in
+    different drafts.
+    """
+
+    def setUp(self):
+        self.site = Site({
+            'one.md': u'order: b\n\none\n',
+            'two.md': u'order: a\n\ntwo\n',
+            'three.md': u'order: c\n    d\n\nthree\n',
+            'list.md': u"{= ' '.join(page['relpath'] for page in pages(sort='order')) =}\n",
+        })
+        self.addCleanup(self.site.remove)
+
+    def test_mixed_values(self):
+        code, out = self.site.run()
+        self.assertEqual(code, 0, out)
+        self.assertIn('; 0 errors', out)
+
+        self.assertIn('two.md one.md three.md list.md',
+                      self.site.read('output/list.html'))
+
+
+if __name__ == '__main__':
+    unittest.main()
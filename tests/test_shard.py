@@ -0,0 +1,64 @@
+from __future__ import print_function, with_statement
+
+import os
+import json
+import unittest
+
+import six
+
+from tests.site import Site
+
+
+class MergeTest(unittest.TestCase):
+    """merge-manifests removes nothing unless it is given one manifest for
+    each shard of one build.
+    """
+
+    def setUp(self):
+        self.site = Site({'a.md': u'a\n'})
+        self.addCleanup(self.site.remove)
+
+        code, out = self.site.run()
+        self.assertEqual(code, 0, out)
+
+        self.site.write('output/orphan.html', u'orphan\n')
+
+    def merge(self, *shards):
+        paths = []
+        for i, n in shards:
+            path = 'shard-{}-{}.json'.format(i, n)
+            manifest = {'shard': [i, n], 'files': {}}
+            self.site.write(path, six.text_type(json.dumps(manifest)))
+            paths.append(path)
+
+        return self.site.run('merge-manifests', *paths)
+
+    def assertNotMerged(self, out):
+        self.assertIn('error', out)
+        self.assertTrue(os.path.exists(self.site.path('output/orphan.html')))
+
+    def test_merged(self):
+        code, out = self.merge((1, 2), (2, 2))
+        self.assertFalse(os.path.exists(self.site.path('output/orphan.html')))
+
+    def test_shard_out_of_range(self):
+        code, out = self.merge((1, 2), (2, 2), (3, 2))
+        self.assertNotMerged(out)
+
+        code, out = self.merge((0, 1), (1, 1))
+        self.assertNotMerged(out)
+
+    def test_shard_not_an_integer(self):
+        code, out = self.merge((1, 2), (2.5, 2), (2, 2))
+        self.assertNotMerged(out)
+
+    def test_mixed_number_of_shards(self):
+        code, out = self.merge((1, 1), (1, 2), (2, 2))
+        self.assertNotMerged(out)
+
+        code, out = self.merge((1, 2), (2, 2), (3, 3))
+        self.assertNotMerged(out)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+from __future__ import print_function, with_statement
+
+import unittest
+
+from tests.site import Site
+
+
+class TimeLimitTest(unittest.TestCase):
+    """Pages that run out of time are reported with the line number of the
+    {-sequence that was running, and the other pages are still published.
+    """
+
+    def setUp(self):
+        self.site = Site({
+            'ok.md': u'fine\n',
+            'bare.md': u'before\n\n{!\nwhile True:\n    try:\n        pass\n'
+                       u'    except:\n        pass\n!}\n',
+        }, presto={'sequence_time_limit': '0.5', 'page_time_limit': '1'})
+        self.addCleanup(self.site.remove)
+
+    def errors(self, out):
+        return [line for line in out.splitlines() if 'error' in line and 'bare.md' in line]
+
+    def check(self, *args):
+        code, out = self.site.run(*args)
+
+        errors = self.errors(out)
+        self.assertEqual(len(errors), 1, out)
+        self.assertIn('bare.md: line 3: ', errors[0])
+
+        self.assertIn('fine', self.site.read('output/ok.html'))
+
+    def test_bare_except(self):
+        self.check()
+
+    def test_bare_except_with_jobs(self):
+        self.check('--jobs', '2')
+
+
+if __name__ == '__main__':
+    unittest.main()